@@ -0,0 +1,166 @@
+# --- CONTROLE DE ADMISSÃO (LIMITE POR USUÁRIO E DESCARTE DE CARGA) ---
+# Roda antes da rota, portanto antes de check_and_deduct_credit: quem passa do limite não paga crédito.
+#
+#   - token bucket por usuário (todas as rotas somadas) e por usuário + rota, no SQLite local
+#     (um único UPSERT ... RETURNING por bucket, valendo para todos os workers). Estourou: 429 + Retry-After.
+#   - semáforo global de chamadas ao modelo e ao Replicate, compartilhado entre os workers por flock
+#     em ADMISSION_MAX_CONCURRENT arquivos de vaga (o kernel solta a vaga se o processo morrer).
+#     Sem vaga: 503 + Retry-After na hora, sem fila.
+#
+# Limites no formato "por_minuto:rajada":
+#   ADMISSION_USER_LIMIT="60:30"     ADMISSION_ROUTE_LIMIT="20:10"
+#   ADMISSION_ROUTE_LIMITS="/generate-image=6:3,/generate-image/batch=2:2"
+#   ADMISSION_MAX_CONCURRENT=200     ADMISSION=0 desliga tudo
+import fcntl
+import os
+import random
+import time
+
+from flask import g, jsonify, request
+
+import local_store
+import metrics
+
+ENABLED = os.environ.get('ADMISSION', '1') != '0'
+MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 200))
+SHED_RETRY_AFTER = 2          # Segundos sugeridos quando não há vaga no semáforo global
+BUCKET_TTL = 3600             # Buckets parados há mais tempo que isso são apagados
+STORE = 'admissao'
+SLOTS_DIR = os.path.join(local_store.STATE_DIR, 'vagas')
+
+# Rotas que chamam o Gemini ou o Replicate (só POST)
+ROUTES = (
+    '/generate-prompt', '/generate-veo3-prompt', '/summarize-video', '/format-abnt', '/summarize-text',
+    '/generate-spreadsheet', '/upload-document', '/ask-document', '/corporate-translator',
+    '/generate-social-media', '/correct-essay', '/mock-interview', '/generate-study-material',
+    '/generate-cover-letter', '/generate-image', '/generate-image/jobs', '/generate-image/batch',
+)
+DEFAULT_ROUTE_LIMITS = '/generate-image=6:3,/generate-image/jobs=6:3,/generate-image/batch=2:2'
+
+
+def parse_limit(text):
+    # "60:30" -> (tokens por segundo, rajada)
+    per_minute, _, burst = text.partition(':')
+    per_minute = float(per_minute)
+    return per_minute / 60.0, float(burst or per_minute)
+
+def parse_route_limits(text):
+    limits = {}
+    for part in filter(None, (text or '').split(',')):
+        route, _, limit = part.partition('=')
+        limits[route.strip()] = parse_limit(limit)
+    return limits
+
+USER_LIMIT = parse_limit(os.environ.get('ADMISSION_USER_LIMIT', '60:30'))
+ROUTE_LIMIT = parse_limit(os.environ.get('ADMISSION_ROUTE_LIMIT', '20:10'))
+ROUTE_LIMITS = parse_route_limits(DEFAULT_ROUTE_LIMITS)
+ROUTE_LIMITS.update(parse_route_limits(os.environ.get('ADMISSION_ROUTE_LIMITS')))
+
+local_store.connect(STORE).execute(
+    "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+
+
+# --- Token bucket ---
+def take(key, rate, burst):
+    # Devolve 0 se pegou uma ficha; senão, quantos segundos faltam para a próxima
+    now = time.time()
+    conn = local_store.connect(STORE)
+    row = conn.execute(
+        "INSERT INTO buckets (key, tokens, updated_at) VALUES (?1, ?2 - 1, ?3) "
+        "ON CONFLICT(key) DO UPDATE SET tokens = MIN(?2, tokens + (?3 - updated_at) * ?4) - 1, updated_at = ?3 "
+        "WHERE MIN(?2, tokens + (?3 - updated_at) * ?4) >= 1 RETURNING tokens",
+        (key, burst, now, rate)).fetchone()
+    if random.random() < 0.001:
+        conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - BUCKET_TTL,))
+    if row is not None: return 0
+    current = conn.execute("SELECT MIN(?2, tokens + (?3 - updated_at) * ?4) FROM buckets WHERE key = ?1",
+                           (key, burst, now, rate)).fetchone()
+    return (1 - (current[0] if current else 0)) / rate if rate > 0 else BUCKET_TTL
+
+def refund(key, burst):
+    # Devolve a ficha de um bucket quando um limite seguinte recusou a requisição
+    local_store.connect(STORE).execute("UPDATE buckets SET tokens = MIN(?, tokens + 1) WHERE key = ?", (burst, key))
+
+
+# --- Semáforo global entre workers ---
+def acquire_slot(directory=SLOTS_DIR, count=MAX_CONCURRENT):
+    # Tenta as vagas a partir de uma posição aleatória; devolve o arquivo travado ou None.
+    # Também usado pelo image_batch, com outra pasta e outro número de vagas.
+    os.makedirs(directory, exist_ok=True)
+    start = random.randrange(count)
+    for i in range(count):
+        fd = os.open(os.path.join(directory, f"{(start + i) % count}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+    return None
+
+def release_slot(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def client_key():
+    data = request.get_json(silent=True) if request.mimetype != 'multipart/form-data' else None
+    user_id = (data.get('user_id') if isinstance(data, dict) else None) or request.form.get('user_id') \
+        or request.args.get('user_id')
+    if user_id: return f"u:{user_id}"
+    # Sem usuário: limita pelo IP (o primeiro do X-Forwarded-For atrás do proxy da Render)
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return f"ip:{forwarded.split(',')[0].strip() or request.remote_addr}"
+
+def reject(status, reason, retry_after, message):
+    metrics.inc('admission_rejected_total', route=metrics.current_route(), reason=reason)
+    retry_after = max(1, int(retry_after + 0.999))
+    return jsonify({'error': message, 'retry_after': retry_after}), status, {'Retry-After': str(retry_after)}
+
+
+def init_app(app):
+    if not ENABLED: return
+
+    @app.before_request
+    def _admit():
+        route = request.url_rule.rule if request.url_rule is not None else None
+        if request.method != 'POST' or route not in ROUTES: return None
+        client = client_key()
+        user_key = client
+        route_key, route_limit = f"{client}|{route}", ROUTE_LIMITS.get(route, ROUTE_LIMIT)
+
+        wait = take(route_key, *route_limit)
+        if wait: return reject(429, 'route_rate', wait, "Muitas requisições nesta ferramenta. Tente de novo em instantes.")
+        wait = take(user_key, *USER_LIMIT)
+        if wait:
+            refund(route_key, route_limit[1])
+            return reject(429, 'user_rate', wait, "Muitas requisições. Tente de novo em instantes.")
+
+        fd = acquire_slot()
+        if fd is None:
+            refund(route_key, route_limit[1])
+            refund(user_key, USER_LIMIT[1])
+            return reject(503, 'overloaded', SHED_RETRY_AFTER, "Servidor ocupado. Tente de novo em instantes.")
+        g.admission_slot = fd
+        metrics.gauge_add('admission_slots_in_use', 1)
+        return None
+
+    def _release(ctx_g):
+        fd = ctx_g.pop('admission_slot', None)
+        if fd is None: return
+        metrics.gauge_add('admission_slots_in_use', -1)
+        release_slot(fd)
+
+    @app.after_request
+    def _release_on_close(response):
+        # Em streaming a vaga fica presa até o último pedaço sair
+        if 'admission_slot' in g:
+            ctx_g = g._get_current_object()
+            response.call_on_close(lambda: _release(ctx_g))
+        return response
+
+    @app.teardown_request
+    def _release_on_error(exc):
+        # Se a resposta nem chegou a ser montada, call_on_close não roda
+        if exc is not None: _release(g._get_current_object())
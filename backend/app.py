@@ -1,29 +1,43 @@
 import os
-import io
 import json
 import re
-import google.generativeai as genai
-import stripe
-import replicate
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from io import BytesIO
-from flask import Flask, request, jsonify, send_file
+import hashlib
+import tempfile
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS, cross_origin
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 # --- FERRAMENTAS EXTRAS ---
-from pytube import YouTube
-import xml.etree.ElementTree as ET
-from docx import Document
-from pypdf import PdfReader 
+# Módulos que puxam bibliotecas pesadas (Gemini, Stripe, Replicate, docx, pypdf, Pillow) ficam em lazy_tools
+import lazy_tools
+from youtube_transcripts import get_transcript, transcript_key, transcript_store, video_id_from_url
+from summarizer import build_summary_prompt
+from spreadsheet import iter_csv, iter_json_array, write_xlsx
+import history
+from history_writer import HistoryWriter
+from vector_index import VectorIndex
+from response_cache import ResponseCache, make_key
+from profile_cache import ProfileCache
+from singleflight import SingleFlight
+from gemini_client import GeminiClient, ModelUnavailable
+import metrics
+import admission
+
+replicate = lazy_tools.module('replicate', 'replicate')
+image_jobs = lazy_tools.module('replicate', 'image_jobs')
+image_batch = lazy_tools.module('replicate', 'image_batch')
+image_store = lazy_tools.module('images', 'image_store')
+docx_render = lazy_tools.module('docx', 'docx_render')
+pdf_extract = lazy_tools.module('pdf', 'pdf_extract')
 
 # Carrega variáveis do .env
 load_dotenv() 
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
+metrics.init_app(app)
+# Limite por usuário/rota e semáforo global antes das rotas de IA (e antes de cobrar crédito)
+admission.init_app(app)
 
 # --- CONFIGURAÇÃO DE CHAVES ---
 stripe_key = os.environ.get("STRIPE_SECRET_KEY")
@@ -31,66 +45,418 @@ stripe_price = os.environ.get("STRIPE_PRICE_ID")
 frontend_url = os.environ.get("FRONTEND_URL")
 endpoint_secret = os.environ.get('STRIPE_WEBHOOK_SECRET')
 
-stripe.api_key = stripe_key
+def load_stripe():
+    import stripe
+    stripe.api_key = stripe_key
+    # STRIPE_API_BASE aponta para um Stripe falso nos testes de carga (fake_upstreams.py)
+    if os.environ.get('STRIPE_API_BASE'): stripe.api_base = os.environ['STRIPE_API_BASE']
+    return stripe
+
+stripe = lazy_tools.tool('stripe', load_stripe)
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
+def load_supabase():
+    from supabase import create_client
+    return create_client(url, key)
+
 if url and key:
-    supabase: Client = create_client(url, key)
+    supabase = lazy_tools.tool('supabase', load_supabase)
 else:
     print("ERRO CRÍTICO: Chaves do Supabase faltando!")
     supabase = None
 
 # --- CONFIGURAÇÃO GEMINI ---
-try:
-    genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-    model = genai.GenerativeModel('gemini-2.0-flash') 
-    print("Modelo Gemini configurado com sucesso!")
-except Exception as e:
-    print(f"Erro ao configurar o modelo Gemini: {e}")
-    model = None
+MODEL_NAME = 'gemini-2.0-flash'
+
+def load_genai():
+    import google.generativeai as genai
+    gemini_options = {'api_key': os.getenv('GOOGLE_API_KEY')}
+    # GEMINI_TRANSPORT=rest + GEMINI_API_ENDPOINT apontam para um Gemini falso nos testes de carga
+    if os.getenv('GEMINI_TRANSPORT'): gemini_options['transport'] = os.getenv('GEMINI_TRANSPORT')
+    if os.getenv('GEMINI_API_ENDPOINT'): gemini_options['client_options'] = {'api_endpoint': os.getenv('GEMINI_API_ENDPOINT')}
+    genai.configure(**gemini_options)
+    return genai
+
+def load_model():
+    # Sem modelo (chave errada, biblioteca quebrada) as rotas respondem "Erro modelo", como antes
+    try:
+        loaded = genai.GenerativeModel(MODEL_NAME)
+        print("Modelo Gemini configurado com sucesso!")
+        return loaded
+    except Exception as e:
+        print(f"Erro ao configurar o modelo Gemini: {e}")
+        return None
+
+genai = lazy_tools.tool('gemini', load_genai)
+model = lazy_tools.tool('gemini', load_model)
+
+# Prazo, retentativas, circuit breaker e modelo reserva (gemini_client.py). GEMINI_FALLBACK_MODEL= desliga o reserva.
+FALLBACK_MODEL = os.environ.get('GEMINI_FALLBACK_MODEL', 'gemini-2.0-flash-lite')
+FALLBACK_CACHE_TTL = 300     # Resposta do reserva fica pouco tempo no cache: a do principal é melhor
+gemini = GeminiClient(MODEL_NAME, FALLBACK_MODEL, lambda name: model.load() if name == MODEL_NAME else genai.GenerativeModel(name))
+
+# --- CACHE DE RESPOSTAS (entradas iguais não chamam o Gemini de novo) ---
+response_cache = ResponseCache(
+    'respostas',
+    memory_bytes=int(os.environ.get('RESPONSE_CACHE_MEMORY_MB', 32)) * 1024 * 1024,
+    disk_bytes=int(os.environ.get('RESPONSE_CACHE_DISK_MB', 512)) * 1024 * 1024,
+    ttl=int(os.environ.get('RESPONSE_CACHE_TTL', 24 * 3600))
+)
+
+# Mude a versão quando os prompts do resumo de vídeo mudarem (invalida os resumos em cache)
+VIDEO_SUMMARY_PROMPT_VERSION = 1
+
+# Pedidos idênticos simultâneos (mesma chave do cache) fazem uma única chamada ao Gemini
+model_calls = SingleFlight()
+
+metrics.register_cache('respostas', response_cache.stats)
+metrics.register_cache('transcricoes', transcript_store.stats)
+
+def cacheable(text, validate=None):
+    # validate(texto) levanta exceção quando a saída não serve para a rota (ex.: JSON quebrado).
+    # Saída inválida nunca entra no cache: senão o mesmo pedido falharia (e cobraria crédito) por 24h.
+    if not text or not text.strip(): return False
+    if validate is None: return True
+    try:
+        validate(text)
+        return True
+    except Exception:
+        return False
+
+def cached_response(key, validate=None):
+    cached = response_cache.get(key)
+    if cached is None or cacheable(cached, validate): return cached
+    response_cache.delete(key)    # Entrada ruim gravada antes da validação existir
+    return None
+
+def generate_text(route, prompt, generation_config=None, validate=None):
+    key = make_key(route, MODEL_NAME, prompt, generation_config)
+    cached = cached_response(key, validate)
+    if cached is not None: return cached
+    # A etapa "model" inclui a espera de quem pegou carona numa chamada igual já em andamento
+    with metrics.stage('model'):
+        return model_calls.do(key, lambda: _generate_uncached(route, key, prompt, generation_config, validate))
+
+def parse_int(value, default):
+    # Número vindo do corpo da requisição; None se não for inteiro (a rota responde 400)
+    if value is None or value == '': return default
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def parse_json_output(output):
+    # Tira as cercas de markdown e o texto em volta do objeto JSON
+    json_text = output.replace("```json", "").replace("```", "").strip()
+    if "{" in json_text: json_text = json_text[json_text.find("{"):json_text.rfind("}")+1]
+    return json.loads(json_text)
+
+def error_response(e):
+    # Gemini fora do ar ou lento demais não é erro do servidor: 503 para o cliente tentar de novo
+    if isinstance(e, ModelUnavailable):
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    return jsonify({'error': str(e)}), 500
+
+def _generate_uncached(route, key, prompt, generation_config, validate):
+    text, used = gemini.generate(prompt, generation_config, route=route)
+    if cacheable(text, validate): response_cache.set(key, text, ttl=None if used == MODEL_NAME else FALLBACK_CACHE_TTL)
+    return text
+
+# --- CACHE DE PERFIS (compartilhado entre créditos, portal e webhook) ---
+profile_cache = ProfileCache(
+    ttl=int(os.environ.get('PROFILE_CACHE_TTL', 60)),
+    max_entries=int(os.environ.get('PROFILE_CACHE_MAX', 10000))
+)
+
+def get_profile(user_id):
+    profile = profile_cache.get(user_id)
+    if profile is not None and 'stripe_customer_id' in profile: return profile
+    resp = supabase.table('profiles').select('credits, is_pro, stripe_customer_id').eq('id', user_id).execute()
+    if not resp.data: return None
+    profile_cache.update(user_id, **resp.data[0])
+    return resp.data[0]
 
 # --- FUNÇÃO DE CRÉDITOS (BLINDADA) ---
 def check_and_deduct_credit(user_id):
     try:
         if not supabase: return False, "Erro de banco de dados."
-        response = supabase.table('profiles').select('credits, is_pro').eq('id', user_id).execute()
+
+        # Usuários PRO em cache nem vão ao banco
+        cached = profile_cache.get(user_id)
+        if cached and cached.get('is_pro'): return True, "Sucesso (VIP)"
+
+        # Uma única chamada atômica: desconta se tiver saldo e devolve saldo + PRO (sql/002_consume_credit.sql)
+        with metrics.stage('credits', service='supabase'):
+            response = supabase.rpc('consume_credit', {'p_user_id': user_id}).execute()
         
         if not response.data: return False, "Usuário não encontrado."
         
         user_data = response.data[0]
-        credits = user_data.get('credits', 0) # Previne erro se for null
-        is_pro = user_data.get('is_pro', False) 
+        profile_cache.update(user_id, credits=user_data.get('credits'), is_pro=bool(user_data.get('is_pro')))
         
         # Se for PRO, uso liberado
-        if is_pro: 
-             return True, "Sucesso (VIP)"
+        if user_data.get('is_pro'): 
+            return True, "Sucesso (VIP)"
             
-        # Se for Grátis, verifica saldo
-        if credits <= 0: 
+        # Se for Grátis e não descontou, está sem saldo
+        if not user_data.get('charged'): 
             return False, "Sem créditos. Assine o PRO!"
             
-        # Deduz 1 crédito do plano grátis
-        new_credits = credits - 1
-        supabase.table('profiles').update({'credits': new_credits}).eq('id', user_id).execute()
         return True, "Sucesso"
     except Exception as e: return False, str(e)
 
 # --- FUNÇÃO AUXILIAR: EMBEDDINGS ---
-def get_embedding(text):
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_BATCH = 100   # Limite de textos por chamada do batch de embeddings
+CHUNK_SIZE = 1500       # Caracteres por trecho do documento
+CHUNK_OVERLAP = 200     # Sobreposição entre trechos para não cortar o contexto
+TOP_K_CHUNKS = 6        # Trechos enviados ao Gemini em cada pergunta
+
+def get_embedding(text, task_type="retrieval_document"):
     try:
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document",
-            title="Documento do Usuário"
-        )
+        params = {'model': EMBEDDING_MODEL, 'content': text, 'task_type': task_type}
+        if task_type == "retrieval_document": params['title'] = "Documento do Usuário"
+        with metrics.stage('embeddings', service='gemini'):
+            result = genai.embed_content(**params)
         return result['embedding']
     except Exception as e:
         print(f"Erro embedding: {e}")
         return None
 
+def get_embeddings(texts, task_type="retrieval_document"):
+    # Gera os vetores em lotes (uma chamada por lote em vez de uma por trecho)
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH):
+        batch = texts[i:i + EMBEDDING_BATCH]
+        with metrics.stage('embeddings', service='gemini'):
+            result = genai.embed_content(model=EMBEDDING_MODEL, content=batch, task_type=task_type)
+        vectors.extend(result['embedding'])
+    return vectors
+
+def split_into_chunks(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    # Quebra preferencialmente em fim de parágrafo/frase para manter trechos legíveis
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            cut = max(text.rfind("\n", start + size // 2, end), text.rfind(". ", start + size // 2, end))
+            if cut != -1: end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk: chunks.append(chunk)
+        if end >= length: break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def parse_vector(value):
+    # O pgvector volta do PostgREST como texto "[0.1,0.2,...]"
+    if isinstance(value, str): return json.loads(value)
+    return value
+
+def store_document_chunks(document_id, user_id, content_hash, chunks, start_index=0):
+    if not chunks: return 0
+    vectors = get_embeddings(chunks)
+    rows = [{
+        'document_id': document_id,
+        'user_id': user_id,
+        'content_hash': content_hash,
+        'chunk_index': start_index + i,
+        'content': chunk,
+        'embedding': vector
+    } for i, (chunk, vector) in enumerate(zip(chunks, vectors))]
+    # Upsert pelo índice único (content_hash, chunk_index): dois primeiros uploads simultâneos do mesmo
+    # PDF gravam um só conjunto de trechos (sql/005)
+    for i in range(0, len(rows), EMBEDDING_BATCH):
+        supabase.table('document_chunks').upsert(rows[i:i + EMBEDDING_BATCH], on_conflict='content_hash,chunk_index').execute()
+    return len(rows)
+
+def discard_partial_chunks(document_id, content_hash):
+    # A indexação falhou no meio: apaga os trechos já gravados, a não ser que outra cópia do mesmo
+    # conteúdo exista (pode estar indexando agora e contar com essas linhas)
+    other = supabase.table('documents').select('id').eq('content_hash', content_hash).neq('id', document_id).limit(1).execute()
+    if other.data: return
+    supabase.table('document_chunks').delete().eq('document_id', document_id).execute()
+
+# --- INDEXAÇÃO INCREMENTAL DE PDF ---
+SPOOL_THRESHOLD = 4 * 1024 * 1024     # Acima disso o texto extraído vai para disco, não fica na RAM
+INDEX_FLUSH_CHARS = 60000             # A cada ~40 trechos, grava e gera embeddings
+DOCUMENT_CONTENT_MAX = int(os.environ.get('DOCUMENT_CONTENT_MAX', 1_000_000))  # Texto inteiro só em documentos menores
+
+def save_upload(file, path, block_size=1024 * 1024):
+    # Grava o upload em disco calculando o SHA-256 no mesmo passo
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        while True:
+            block = file.stream.read(block_size)
+            if not block: break
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest()
+
+def find_indexed_document(content_hash):
+    # Documento com o mesmo conteúdo que já foi extraído e indexado com sucesso
+    resp = supabase.table('documents').select('id, chunk_count').eq('content_hash', content_hash) \
+        .gt('chunk_count', 0).order('created_at').limit(1).execute()
+    return resp.data[0] if resp.data else None
+
+def index_pdf(pdf_path, user_id, filename, content_hash):
+    # Extrai as páginas em paralelo e vai gravando os trechos enquanto lê.
+    # Devolve (document_id, trechos) ou (None, 0) se o PDF não tem texto.
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD, mode='w+', encoding='utf-8')
+    pending, pending_len = [], 0
+    text_chars = 0
+    doc_id, chunk_count, indexing = None, 0, True
+
+    def flush(final):
+        nonlocal doc_id, chunk_count, indexing, pending, pending_len
+        if doc_id is None:
+            doc = supabase.table('documents').insert({
+                'user_id': user_id, 'filename': filename, 'content': '', 'content_hash': content_hash
+            }).execute()
+            doc_id = doc.data[0]['id']
+        chunks = split_into_chunks("\n".join(pending))
+        # O último trecho volta para o buffer para não cortar o texto na fronteira do lote
+        carry = [] if final or not chunks else [chunks.pop()]
+        if indexing:
+            try:
+                chunk_count += store_document_chunks(doc_id, user_id, content_hash, chunks, start_index=chunk_count)
+            except Exception as emb_err:
+                print(f"Aviso: documento salvo sem embeddings: {emb_err}")
+                indexing = False
+                try:
+                    discard_partial_chunks(doc_id, content_hash)
+                except Exception as e:
+                    print(f"Aviso: falha ao apagar trechos parciais: {e}")
+        pending, pending_len = carry, sum(len(c) for c in carry)
+
+    with spool:
+        for page_text in pdf_extract.iter_page_texts(pdf_path):
+            if not page_text: continue
+            spool.write(page_text)
+            spool.write("\n")
+            text_chars += len(page_text.strip())
+            pending.append(page_text)
+            pending_len += len(page_text) + 1
+            if pending_len >= INDEX_FLUSH_CHARS and text_chars >= 10: flush(final=False)
+
+        # Proteção contra PDF que é apenas Imagem/Foto
+        if text_chars < 10: return None, 0
+
+        flush(final=True)
+        if not indexing: chunk_count = 0
+
+        # chunk_count > 0 marca o conteúdo como reaproveitável por uploads iguais.
+        # Documentos grandes ficam só com os trechos; o texto inteiro é o fallback se não houver embeddings
+        final = {'chunk_count': chunk_count}
+        if spool.tell() <= DOCUMENT_CONTENT_MAX or not indexing:
+            spool.seek(0)
+            final['content'] = spool.read()
+        supabase.table('documents').update(final).eq('id', doc_id).execute()
+
+    return doc_id, chunk_count
+
+def load_user_chunks(user_id, page_size=1000):
+    # Os trechos ficam guardados pelo hash do conteúdo: o usuário enxerga os trechos dos PDFs que enviou,
+    # mesmo que tenham sido indexados no upload de outra pessoa. Só conta conteúdo indexado até o fim
+    # (chunk_count > 0, copiado do documento canônico de find_indexed_document) e só até chunk_count:
+    # sobras de uma indexação que falhou não entram no índice.
+    docs = supabase.table('documents').select('id, content_hash, chunk_count').eq('user_id', user_id).execute().data
+    counts = {}
+    for d in docs:
+        if d.get('content_hash') and d.get('chunk_count'):
+            counts[d['content_hash']] = max(counts.get(d['content_hash'], 0), d['chunk_count'])
+    hashes = sorted(counts)
+    legacy_ids = [d['id'] for d in docs if not d.get('content_hash')]
+
+    rows = []
+    def fetch(column, values):
+        # Pagina porque o PostgREST limita as linhas por resposta
+        start = 0
+        while True:
+            resp = supabase.table('document_chunks').select('document_id, content_hash, chunk_index, content, embedding') \
+                .in_(column, values).order('id').range(start, start + page_size - 1).execute()
+            for row in resp.data:
+                if row.get('content_hash') and row['chunk_index'] >= counts.get(row['content_hash'], 0): continue
+                row['embedding'] = parse_vector(row['embedding'])
+                row['source_id'] = row.get('content_hash') or row['document_id']
+                rows.append(row)
+            if len(resp.data) < page_size: break
+            start += page_size
+
+    if hashes: fetch('content_hash', hashes)
+    if legacy_ids: fetch('document_id', legacy_ids)
+    return rows
+
+vector_index = VectorIndex(load_user_chunks, max_bytes=int(os.environ.get('VECTOR_INDEX_MAX_MB', 256)) * 1024 * 1024,
+                           ttl=int(os.environ.get('VECTOR_INDEX_TTL', 600)))
+
+def retrieve_chunks(user_id, source_id, question, k=TOP_K_CHUNKS, indexed=False):
+    query_vector = get_embedding(question, task_type="retrieval_query")
+    if not query_vector: return []
+    with metrics.stage('retrieval'):
+        best = vector_index.search(user_id, query_vector, k=k, source_id=source_id)
+        if not best and indexed:
+            # O banco diz que o documento tem trechos mas o índice em memória não: recarrega uma vez
+            vector_index.forget(user_id)
+            best = vector_index.search(user_id, query_vector, k=k, source_id=source_id)
+    # Devolve na ordem original do documento para o modelo ler com fluidez
+    return [content for _, _, content in sorted(best, key=lambda item: item[1])]
+
+# --- HISTÓRICO GRAVADO PELO SERVIDOR ---
+# Inserts do user_history saem em lote por uma thread (history_writer.py), fora do caminho da requisição
+history_buffer = HistoryWriter(lambda rows: supabase.table('user_history').insert(rows).execute())
+
+def record_history(data, tool_type, input_data, output_data, metadata=None):
+    # Opt-in: {"save_history": true} grava o resultado nesta mesma requisição, sem o POST extra em /save-history
+    if not data.get('save_history') or not output_data: return
+    history_buffer.add(history.history_row(data.get('user_id'), tool_type, input_data, output_data, metadata, data.get('tool_name')))
+
+# --- STREAMING (SSE) PARA RESPOSTAS LONGAS ---
+def wants_stream(data):
+    # Opt-in: {"stream": true} no corpo ou ?stream=1 na URL
+    return bool(data.get('stream')) or request.args.get('stream') == '1'
+
+def stream_text(route, prompt, generation_config=None, validate=None):
+    key = make_key(route, MODEL_NAME, prompt, generation_config)
+    cached = cached_response(key, validate)
+    if cached is not None:
+        yield cached
+        return
+    with metrics.stage('model'):
+        yield from model_calls.stream(key, lambda: _stream_uncached(route, key, prompt, generation_config, validate))
+
+def _stream_uncached(route, key, prompt, generation_config, validate):
+    parts, used = [], MODEL_NAME
+    for piece, used in gemini.stream(prompt, generation_config, route=route):
+        parts.append(piece)
+        yield piece
+    text = "".join(parts)
+    if cacheable(text, validate): response_cache.set(key, text, ttl=None if used == MODEL_NAME else FALLBACK_CACHE_TTL)
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def sse_response(route, prompt, build_payload, on_complete=None, pieces=None):
+    # Eventos "delta" com cada pedaço do texto e um "done" final com o mesmo JSON da rota normal.
+    # pieces permite transmitir um texto que já está pronto (ex.: vindo de cache).
+    def events():
+        parts = []
+        try:
+            for piece in (pieces if pieces is not None else stream_text(route, prompt)):
+                parts.append(piece)
+                yield sse_event('delta', {'text': piece})
+            text = "".join(parts)
+            if on_complete and text.strip(): on_complete(text)
+            yield sse_event('done', build_payload(text))
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/')
 def health_check():
     return jsonify({'status': 'ok', 'service': 'Adapta IA Backend'})
@@ -99,6 +465,25 @@ def health_check():
 def health():
     return jsonify({'status': 'healthy'}), 200
 
+def metrics_authorized():
+    # METRICS_TOKEN protege as rotas de diagnóstico (/metrics e /cache-stats) se definido
+    token = os.environ.get('METRICS_TOKEN')
+    return not token or request.headers.get('Authorization') == f"Bearer {token}" or request.args.get('token') == token
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus por padrão; ?format=json traz p50/p95/p99 prontos
+    if not metrics_authorized(): return jsonify({'error': 'Não autorizado'}), 401
+    if request.args.get('format') == 'json': return jsonify(metrics.summary())
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache-stats')
+def cache_stats():
+    if not metrics_authorized(): return jsonify({'error': 'Não autorizado'}), 401
+    return jsonify({'responses': response_cache.stats(), 'vectors': vector_index.stats(), 'history': history_buffer.stats(),
+                    'model_calls': model_calls.stats(), 'tools': lazy_tools.stats(),
+                    'gemini': gemini.stats()})
+
 # ============================================
 # ROTAS DAS FERRAMENTAS IA
 # ============================================
@@ -133,14 +518,15 @@ def generate_prompt():
         2. Use palavras-chave técnicas poderosas (ex: 8k, photorealistic, cinematic lighting).
         """
         
-        response = model.generate_content(prompt)
+        output = generate_text('/generate-prompt', prompt)
+        record_history(data, 'image-prompt', idea, output.strip(), {'style': style})
         return jsonify({
-            'prompt': response.text.strip(),
-            'advanced_prompt': response.text.strip()
+            'prompt': output.strip(),
+            'advanced_prompt': output.strip()
         })
         
     except Exception as e: 
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 # 2. GERADOR DE PROMPT DE VÍDEO
 @app.route('/generate-veo3-prompt', methods=['POST'])
@@ -168,11 +554,12 @@ def generate_veo3_prompt():
         Saída: APENAS o prompt em Inglês detalhado, focado em movimento e fluidez.
         """
         
-        response = model.generate_content(ai_prompt)
-        return jsonify({'prompt': response.text.strip()})
+        output = generate_text('/generate-veo3-prompt', ai_prompt)
+        record_history(data, 'veo3-prompt', idea, output.strip(), {'style': style, 'camera': camera})
+        return jsonify({'prompt': output.strip()})
         
     except Exception as e: 
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 # 3. RESUMIDOR YOUTUBE
 @app.route('/summarize-video', methods=['POST'])
@@ -188,21 +575,38 @@ def summarize_video():
         s, m = check_and_deduct_credit(user_id)
         if not s: return jsonify({'error': m}), 402
 
-        yt = YouTube(data.get('url'))
-        caption = yt.captions.get_by_language_code('pt')
-        if not caption: caption = yt.captions.get_by_language_code('en')
-        if not caption: caption = yt.captions.get_by_language_code('a.pt') 
+        # Resumo pronto do mesmo vídeo/idioma/versão do prompt: não chama nem o YouTube nem o Gemini
+        video_id = video_id_from_url(data.get('url'))
+        summary_key = make_key('/summarize-video:summary', MODEL_NAME, transcript_key(video_id), {'prompt_version': VIDEO_SUMMARY_PROMPT_VERSION})
+        cached = response_cache.get(summary_key)
+        if cached is not None:
+            record_history(data, 'video-summary', data.get('url'), cached)
+            if wants_stream(data): return sse_response(None, None, lambda out: {'summary': out}, pieces=[cached])
+            return jsonify({'summary': cached})
+
+        with metrics.stage('transcript', service='youtube'):
+            video_id, lang, text = get_transcript(data.get('url'))
+        if not lang or not text: return jsonify({'error': 'Sem legendas disponíveis neste vídeo.'}), 400
         
-        if not caption: return jsonify({'error': 'Sem legendas disponíveis neste vídeo.'}), 400
-        
-        xml = caption.xml_captions
-        root = ET.fromstring(xml)
-        text = " ".join([elem.text for elem in root.iter('text') if elem.text])
-        
-        prompt = f"Resuma o seguinte vídeo: {text[:30000]}"
-        response = model.generate_content(prompt)
-        return jsonify({'summary': response.text})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        # Transcrições longas são resumidas por partes em paralelo em vez de cortadas
+        prompt = build_summary_prompt(
+            text, lambda p: generate_text('/summarize-video:map', p),
+            direct_prompt="Resuma o seguinte vídeo: {text}",
+            map_prompt="Resuma este trecho (parte {part} de {total}) da transcrição de um vídeo, mantendo as ideias, nomes e números importantes: {text}",
+            reduce_prompt="Os resumos abaixo são partes consecutivas da transcrição de um mesmo vídeo. Junte-os num único resumo do vídeo: {text}",
+            max_tokens=8000
+        )
+        def finish(out):
+            # O resumo não vive mais que a resposta de onde veio: se ela foi do modelo reserva, o TTL é o curto
+            final_key = make_key('/summarize-video', MODEL_NAME, prompt, None)
+            response_cache.set(summary_key, out, ttl=response_cache.remaining_ttl(final_key) or FALLBACK_CACHE_TTL)
+            record_history(data, 'video-summary', data.get('url'), out)
+
+        if wants_stream(data): return sse_response('/summarize-video', prompt, lambda out: {'summary': out}, on_complete=finish)
+        output = generate_text('/summarize-video', prompt)
+        finish(output)
+        return jsonify({'summary': output})
+    except Exception as e: return error_response(e)
 
 # 4. ABNT
 @app.route('/format-abnt', methods=['POST'])
@@ -219,9 +623,10 @@ def format_abnt():
         if not s: return jsonify({'error': m}), 402
         
         prompt = f"Formate o texto abaixo seguindo as normas da ABNT (use Markdown): {data.get('text')}"
-        response = model.generate_content(prompt)
-        return jsonify({'formatted_text': response.text})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        output = generate_text('/format-abnt', prompt)
+        record_history(data, 'abnt', data.get('text'), output)
+        return jsonify({'formatted_text': output})
+    except Exception as e: return error_response(e)
 
 # 5. RESUMIDOR DE TEXTOS
 @app.route('/summarize-text', methods=['POST'])
@@ -240,10 +645,21 @@ def summarize_text():
         text = data.get('text', '')
         if len(text) < 50: return jsonify({'error': 'Texto muito curto.'}), 400
         
-        prompt = f"Resuma o texto mantendo os pontos principais (aprox 20% do tamanho): {text[:15000]}"
-        response = model.generate_content(prompt)
-        return jsonify({'summary': response.text})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        # Textos longos são resumidos por partes em paralelo em vez de cortados
+        prompt = build_summary_prompt(
+            text, lambda p: generate_text('/summarize-text:map', p),
+            direct_prompt="Resuma o texto mantendo os pontos principais (aprox 20% do tamanho): {text}",
+            map_prompt="Resuma este trecho (parte {part} de {total}) de um texto maior, mantendo os pontos principais, nomes e números: {text}",
+            reduce_prompt="Os resumos abaixo são partes consecutivas de um mesmo texto. Junte-os num único resumo coeso mantendo os pontos principais: {text}",
+            max_tokens=4000
+        )
+        if wants_stream(data):
+            return sse_response('/summarize-text', prompt, lambda out: {'summary': out},
+                                on_complete=lambda out: record_history(data, 'text-summary', text, out))
+        output = generate_text('/summarize-text', prompt)
+        record_history(data, 'text-summary', text, output)
+        return jsonify({'summary': output})
+    except Exception as e: return error_response(e)
 
 # 6. DOWNLOAD DOCX (Não gasta crédito, é só utilitário)
 @app.route('/download-docx', methods=['POST'])
@@ -252,24 +668,47 @@ def download_docx():
         data = request.get_json(force=True)
         if isinstance(data, str): data = json.loads(data)
 
-        doc = Document()
-        doc.add_paragraph(data.get('markdown_text'))
-        f = io.BytesIO()
-        doc.save(f)
-        f.seek(0)
+        # Títulos, listas e tabelas do Markdown viram estilos reais do Word (base ABNT)
+        with metrics.stage('render'):
+            f = docx_render.render_docx_bytes(data.get('markdown_text'))
         return send_file(f, as_attachment=True, download_name='doc.docx', mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    except Exception as e: return jsonify({'error': str(e)}), 500
+    except Exception as e: return error_response(e)
 
 # 7. GERADOR DE PLANILHAS
+SPREADSHEET_MAX_ROWS = int(os.environ.get('SPREADSHEET_MAX_ROWS', 5000))
+SPREADSHEET_BATCH_ROWS = 100   # Linhas pedidas ao modelo por chamada (limite de saída do Gemini)
+
+def has_json_rows(text):
+    if next(iter_json_array([text]), None) is None: raise ValueError("Nenhuma linha no JSON do modelo.")
+
+def generate_spreadsheet_rows(prompt_user, total):
+    # Pede as linhas em lotes e entrega cada linha assim que o JSON dela chega no streaming
+    columns, produced = None, 0
+    while produced < total:
+        batch = min(SPREADSHEET_BATCH_ROWS, total - produced)
+        extra = ""
+        if columns:
+            extra = f"Use exatamente estas colunas: {json.dumps(columns, ensure_ascii=False)}. Continue a partir da linha {produced + 1}, sem repetir linhas anteriores."
+        ai_prompt = f"""
+        Você é um Gerador de Dados para Excel.
+        PEDIDO: "{prompt_user}"
+        Gere um JSON com {batch} linhas de dados fictícios.
+        {extra}
+        Responda APENAS o JSON.
+        """
+        got = 0
+        for row in iter_json_array(stream_text('/generate-spreadsheet', ai_prompt, validate=has_json_rows)):
+            if columns is None: columns = list(row.keys())
+            yield row
+            got += 1
+            produced += 1
+            if got >= batch: break
+        if not got: break   # O modelo não devolveu nada aproveitável: não insiste
+    if not columns:
+        yield {"Erro": "Falha ao gerar dados"}
+
 @app.route('/generate-spreadsheet', methods=['POST'])
 def generate_spreadsheet():
-    import pandas as pd
-    import unicodedata
-
-    def remove_acentos(input_str):
-        nfkd_form = unicodedata.normalize('NFKD', input_str)
-        return "".join([c for c in nfkd_form if not unicodedata.combining(c)])
-
     if not model: return jsonify({'error': 'Erro modelo'}), 500
     try:
         data = request.get_json(force=True)
@@ -278,49 +717,34 @@ def generate_spreadsheet():
         # BLOQUEIO DE CRÉDITOS
         user_id = data.get('user_id')
         if not user_id: return jsonify({'error': 'Faça login para usar as ferramentas.'}), 401
+        total_rows = parse_int(data.get('rows'), 5)
+        if total_rows is None: return jsonify({'error': 'rows deve ser um número inteiro'}), 400
         s, m = check_and_deduct_credit(user_id)
         if not s: return jsonify({'error': m}), 402
         
         prompt_user = data.get('prompt')
-        
-        ai_prompt = f"""
-        Você é um Gerador de Dados para Excel.
-        PEDIDO: "{prompt_user}"
-        Gere um JSON com 5 linhas de dados fictícios.
-        Responda APENAS o JSON.
-        """
-        
-        response = model.generate_content(ai_prompt)
-        txt = response.text
-        
-        start = txt.find('[')
-        end = txt.rfind(']')
-        if start != -1 and end != -1:
-            json_str = txt[start:end+1]
-            dados = json.loads(json_str)
-        else:
-            dados = [{"Erro": "Falha ao gerar dados"}]
-
-        df = pd.DataFrame(dados)
-        output = io.BytesIO()
-        
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Relatório IA')
-            workbook  = writer.book
-            worksheet = writer.sheets['Relatório IA']
-            
-            header_fmt = workbook.add_format({'bold': True, 'fg_color': '#1e3a8a', 'font_color': 'white', 'border': 1})
-            
-            for i, col in enumerate(df.columns):
-                worksheet.write(0, i, col, header_fmt)
-                worksheet.set_column(i, i, 20)
-
-        output.seek(0)
+        total_rows = max(1, min(total_rows, SPREADSHEET_MAX_ROWS))
+        output_format = str(data.get('format') or 'xlsx').lower()
+        rows = generate_spreadsheet_rows(prompt_user, total_rows)
+
+        if output_format == 'csv':
+            # CSV sai direto na resposta, linha por linha
+            return Response(stream_with_context(iter_csv(rows)), mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=planilha.csv'})
+
+        # XLSX em modo constant_memory num arquivo temporário (a memória não cresce com o número de linhas)
+        tmp = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+        tmp.close()
+        try:
+            write_xlsx(rows, tmp.name)
+            output = open(tmp.name, 'rb')
+        finally:
+            os.remove(tmp.name)   # O arquivo aberto continua legível até o envio terminar
         return send_file(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name='planilha.xlsx')
 
-    except Exception as e: return jsonify({'error': str(e)}), 500
+    except Exception as e: return error_response(e)
 
-# 8. UPLOAD PDF (SIMPLIFICADO E DIRETO)
+# 8. UPLOAD PDF (EXTRAÇÃO EM PARALELO E INDEXAÇÃO INCREMENTAL)
 @app.route('/upload-document', methods=['POST'])
 def upload_document():
     try:
@@ -332,30 +756,33 @@ def upload_document():
         s, m = check_and_deduct_credit(user_id)
         if not s: return jsonify({'error': m}), 402
 
-        reader = PdfReader(file)
-        text = ""
-        # Lê todas as páginas e junta num texto só
-        for page in reader.pages: 
-            extracted = page.extract_text()
-            if extracted: text += extracted + "\n"
+        # Salva o upload em disco: os processos de extração leem o PDF pelo caminho
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, 'upload.pdf')
+            content_hash = save_upload(file, pdf_path)
+
+            # PDF repetido: novo documento apontando para o conteúdo já extraído e indexado
+            existing = find_indexed_document(content_hash)
+            if existing:
+                doc = supabase.table('documents').insert({
+                    'user_id': user_id, 'filename': file.filename, 'content': '',
+                    'content_hash': content_hash, 'chunk_count': existing['chunk_count']
+                }).execute()
+                vector_index.invalidate(user_id)
+                return jsonify({'message': 'OK', 'document_id': doc.data[0]['id'], 'chunks': existing['chunk_count'], 'deduplicated': True})
+
+            doc_id, chunks = index_pdf(pdf_path, user_id, file.filename, content_hash)
             
         # Proteção contra PDF que é apenas Imagem/Foto
-        if len(text.strip()) < 10:
+        if doc_id is None:
             return jsonify({'error': 'Este PDF é uma imagem ou não possui texto selecionável. Tente outro arquivo.'}), 400
         
-        # SALVA O TEXTO INTEIRO DIRETO NO BANCO
-        doc = supabase.table('documents').insert({
-            'user_id': user_id, 
-            'filename': file.filename,
-            'content': text
-        }).execute()
-        
-        doc_id = doc.data[0]['id']
+        vector_index.invalidate(user_id)
 
-        return jsonify({'message': 'OK', 'document_id': doc_id})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        return jsonify({'message': 'OK', 'document_id': doc_id, 'chunks': chunks})
+    except Exception as e: return error_response(e)
 
-# 9. CHAT PDF (INTELIGENTE - LÊ O DOCUMENTO TODO)
+# 9. CHAT PDF (INTELIGENTE - BUSCA OS TRECHOS RELEVANTES)
 @app.route('/ask-document', methods=['POST'])
 def ask_document():
     if not model: return jsonify({'error': 'Erro modelo'}), 500
@@ -367,23 +794,39 @@ def ask_document():
         if not user_id: return jsonify({'error': 'Faça login para usar as ferramentas.'}), 401
 
         question = data.get('question')
+        if not question: return jsonify({'error': 'Pergunta obrigatória'}), 400
         document_id = data.get('document_id')
 
-        # Busca o texto inteiro do documento
+        # Descobre qual documento usar
         if document_id:
-            doc_response = supabase.table('documents').select('content').eq('id', document_id).execute()
+            doc_response = supabase.table('documents').select('id, content_hash, chunk_count').eq('id', document_id).execute()
         else:
             # Fallback: pega o último enviado
-            doc_response = supabase.table('documents').select('content').eq('user_id', user_id).order('created_at', desc=True).limit(1).execute()
+            doc_response = supabase.table('documents').select('id, content_hash, chunk_count').eq('user_id', user_id).order('created_at', desc=True).limit(1).execute()
 
-        if not doc_response.data or not doc_response.data[0].get('content'):
+        if not doc_response.data:
              return jsonify({'error': 'Não foi possível encontrar o texto deste documento. Faça o upload novamente.'}), 400
 
-        context = doc_response.data[0]['content']
+        document = doc_response.data[0]
+        content_hash = document.get('content_hash')
+
+        # Busca só os trechos mais relevantes para a pergunta
+        chunks = retrieve_chunks(user_id, content_hash or document['id'], question, indexed=bool(document.get('chunk_count')))
+        if chunks:
+            context = "\n\n---\n\n".join(chunks)
+        else:
+            # Documentos sem trechos indexados continuam usando o texto inteiro (guardado no primeiro upload do conteúdo)
+            if content_hash:
+                full = supabase.table('documents').select('content').eq('content_hash', content_hash).neq('content', '').limit(1).execute()
+            else:
+                full = supabase.table('documents').select('content').eq('id', document['id']).execute()
+            if not full.data or not full.data[0].get('content'):
+                 return jsonify({'error': 'Não foi possível encontrar o texto deste documento. Faça o upload novamente.'}), 400
+            context = full.data[0]['content']
         
         # Prompt Mestre
         prompt = f"""Você é um analista de documentos e assistente jurídico altamente inteligente.
-        Leia TODO o documento fornecido abaixo e responda à pergunta do usuário de forma clara e precisa.
+        Leia os trechos do documento fornecidos abaixo e responda à pergunta do usuário de forma clara e precisa.
         Se a informação solicitada não existir no documento, diga educadamente que não encontrou.
         
         DOCUMENTO:
@@ -391,10 +834,15 @@ def ask_document():
         
         PERGUNTA DO USUÁRIO: {question}"""
              
-        resp = model.generate_content(prompt)
+        history_meta = {'document_id': document['id']}
+        if wants_stream(data):
+            return sse_response('/ask-document', prompt, lambda out: {'answer': out},
+                                on_complete=lambda out: record_history(data, 'chat-pdf', question, out, history_meta))
+        output = generate_text('/ask-document', prompt)
+        record_history(data, 'chat-pdf', question, output, history_meta)
         
-        return jsonify({'answer': resp.text})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        return jsonify({'answer': output})
+    except Exception as e: return error_response(e)
 
 # 10. TRADUTOR CORPORATIVO
 @app.route('/corporate-translator', methods=['POST'])
@@ -415,9 +863,10 @@ def corporate_translator():
         target_lang = data.get('target_lang', 'Português')
 
         prompt = f"Reescreva/Traduza o texto: '{text}' para {target_lang} com tom {tone}. Apenas o texto traduzido."
-        resp = model.generate_content(prompt)
-        return jsonify({'translated_text': resp.text.strip()})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        output = generate_text('/corporate-translator', prompt)
+        record_history(data, 'translation', text, output.strip(), {'tone': tone, 'target_lang': target_lang})
+        return jsonify({'translated_text': output.strip()})
+    except Exception as e: return error_response(e)
 
 # 11. SOCIAL MEDIA
 @app.route('/generate-social-media', methods=['POST', 'OPTIONS'])
@@ -441,9 +890,10 @@ def generate_social_media():
         if not topic: return jsonify({'error': 'Tópico obrigatório'}), 400
 
         prompt = f"Crie um post para {platform} sobre '{topic}' com tom {tone}."
-        response = model.generate_content(prompt)
-        return jsonify({'content': response.text.strip()})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        output = generate_text('/generate-social-media', prompt)
+        record_history(data, 'social', topic, output.strip(), {'platform': platform, 'tone': tone})
+        return jsonify({'content': output.strip()})
+    except Exception as e: return error_response(e)
 
 # 12. CORRETOR REDAÇÃO
 @app.route('/correct-essay', methods=['POST'])
@@ -462,11 +912,13 @@ def correct_essay():
         prompt = f"""Corrija a redação sobre '{data.get('theme')}': '{data.get('essay')}'. 
         SAÍDA JSON: {{ "total_score": 0, "competencies": {{...}}, "feedback": "..." }}"""
         
-        response = model.generate_content(prompt)
-        json_text = response.text.replace("```json", "").replace("```", "").strip()
-        if "{" in json_text: json_text = json_text[json_text.find("{"):json_text.rfind("}")+1]
-        return jsonify(json.loads(json_text))
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        output = generate_text('/correct-essay', prompt, validate=parse_json_output)
+        with metrics.stage('postprocess'):
+            result = parse_json_output(output)
+        record_history(data, 'essay', f"Tema: {data.get('theme')}\n\n{data.get('essay') or ''}", result,
+                       {'theme': data.get('theme'), 'score': result.get('total_score') if isinstance(result, dict) else None})
+        return jsonify(result)
+    except Exception as e: return error_response(e)
 
 # 13. MOCK INTERVIEW
 @app.route('/mock-interview', methods=['POST'])
@@ -485,11 +937,13 @@ def mock_interview():
         prompt = f"""Crie 5 perguntas de entrevista para vaga {data.get('role')} na empresa {data.get('company')}.
         SAÍDA JSON: {{ "questions": [{{ "q": "...", "a": "..." }}], "tips": ["..."] }}"""
         
-        response = model.generate_content(prompt)
-        json_text = response.text.replace("```json", "").replace("```", "").strip()
-        if "{" in json_text: json_text = json_text[json_text.find("{"):json_text.rfind("}")+1]
-        return jsonify(json.loads(json_text))
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        output = generate_text('/mock-interview', prompt, validate=parse_json_output)
+        with metrics.stage('postprocess'):
+            result = parse_json_output(output)
+        record_history(data, 'interview', f"{data.get('role')} - {data.get('company')}", result,
+                       {'role': data.get('role'), 'company': data.get('company')})
+        return jsonify(result)
+    except Exception as e: return error_response(e)
 
 # 14. MATERIAL DE ESTUDO
 @app.route('/generate-study-material', methods=['POST'])
@@ -509,9 +963,13 @@ def generate_study_material():
         if not topic: return jsonify({'error': 'Tópico obrigatório'}), 400
 
         prompt = f"Crie um guia de estudos Markdown sobre: {topic}. Nível: {data.get('level')}."
-        response = model.generate_content(prompt)
-        return jsonify({'material': response.text.strip()})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        if wants_stream(data):
+            return sse_response('/generate-study-material', prompt, lambda out: {'material': out.strip()},
+                                on_complete=lambda out: record_history(data, 'study', topic, out.strip(), {'level': data.get('level')}))
+        output = generate_text('/generate-study-material', prompt)
+        record_history(data, 'study', topic, output.strip(), {'level': data.get('level')})
+        return jsonify({'material': output.strip()})
+    except Exception as e: return error_response(e)
 
 # 15. CARTA APRESENTAÇÃO
 @app.route('/generate-cover-letter', methods=['POST'])
@@ -547,9 +1005,13 @@ def generate_cover_letter():
         {user_resume}
         """
         
-        response = model.generate_content(prompt)
-        return jsonify({'cover_letter': response.text})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        if wants_stream(data):
+            return sse_response('/generate-cover-letter', prompt, lambda out: {'cover_letter': out},
+                                on_complete=lambda out: record_history(data, 'cover-letter', job_description, out))
+        output = generate_text('/generate-cover-letter', prompt)
+        record_history(data, 'cover-letter', job_description, output)
+        return jsonify({'cover_letter': output})
+    except Exception as e: return error_response(e)
 
 # ============================================
 # --- ROTA: GERAR IMAGEM COMPLETA ---
@@ -590,10 +1052,11 @@ def generate_image():
                 "output_quality": 80
             }
             
-            output = replicate.run(
-                "black-forest-labs/flux-schnell", # Verifique se este é o modelo que você quer usar
-                input=input_params
-            )
+            with metrics.stage('replicate', service='replicate'):
+                output = replicate.run(
+                    "black-forest-labs/flux-schnell", # Verifique se este é o modelo que você quer usar
+                    input=input_params
+                )
             
             print(f"✅ Saída bruta do Replicate: {output}")
 
@@ -638,9 +1101,14 @@ def generate_image():
         """
 
         # --- RETORNO FINAL SUCESSO ---
+        # --- CACHE LOCAL DA IMAGEM (o link do Replicate expira) ---
+        result = {'image_url': final_image_url}
+        image_id = image_store.materialize_safe(final_image_url)
+        if image_id: result.update(image_store.image_urls(image_id, request.host_url))
+
         print("🎉 Processo finalizado com sucesso. Enviando link para o site.")
         # É VITAL que o retorno seja um dicionário JSON, não o objeto FileOutput bruto.
-        return jsonify({'image_url': final_image_url})
+        return jsonify(result)
 
     except Exception as e:
         # Radar de Erros Geral do Flask
@@ -649,6 +1117,96 @@ def generate_image():
         traceback.print_exc() # Imprime o erro completo no console da Render
         return jsonify({'error': f'Erro interno do servidor: {str(e)}'}), 500
 
+# --- ROTAS: GERAR IMAGEM EM MODO JOB (não segura o worker esperando o Replicate) ---
+def replicate_error_response(rep_err):
+    print(f"❌ ERRO NA CHAMADA AO REPLICATE: {str(rep_err)}")
+    if "credits" in str(rep_err).lower() or "billing" in str(rep_err).lower():
+         return jsonify({'error': 'O saldo do Gerador de Imagens acabou. Por favor, avise o administrador para adicionar mais créditos.'}), 502
+    return jsonify({'error': f'Falha na API do Replicate: {str(rep_err)}'}), 502
+
+@app.route('/generate-image/jobs', methods=['POST'])
+def submit_image_job():
+    try:
+        data = request.get_json(force=True)
+        prompt_completo = data.get('prompt')
+        user_id = data.get('user_id')
+        if not prompt_completo: return jsonify({'error': 'Por favor, insira um prompt.'}), 400
+        if not user_id: return jsonify({'error': 'Usuário não autenticado.'}), 401
+
+        try:
+            with metrics.stage('replicate', service='replicate'):
+                job = image_jobs.submit(user_id, prompt_completo)
+        except Exception as rep_err:
+            return replicate_error_response(rep_err)
+
+        return jsonify(image_jobs.public_job(job, request.host_url)), 202
+    except Exception as e: return error_response(e)
+
+@app.route('/generate-image/jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id: return jsonify({'error': 'Usuário não autenticado.'}), 401
+
+        try:
+            with metrics.stage('replicate', service='replicate'):
+                job = image_jobs.get(job_id, user_id)
+        except Exception as rep_err:
+            return replicate_error_response(rep_err)
+
+        if not job: return jsonify({'error': 'Job não encontrado'}), 404
+        return jsonify(image_jobs.public_job(job, request.host_url))
+    except Exception as e: return error_response(e)
+
+# --- ROTA: GERAR IMAGENS EM LOTE (resultados em NDJSON, um por linha, conforme ficam prontos) ---
+@app.route('/generate-image/batch', methods=['POST'])
+def generate_image_batch():
+    try:
+        data = request.get_json(force=True)
+        user_id = data.get('user_id')
+        prompts = [p for p in (data.get('prompts') or []) if p and str(p).strip()]
+        if not user_id: return jsonify({'error': 'Usuário não autenticado.'}), 401
+        if not prompts: return jsonify({'error': 'Envie pelo menos um prompt.'}), 400
+        if len(prompts) > image_batch.MAX_BATCH_PROMPTS: return jsonify({'error': f'Máximo de {image_batch.MAX_BATCH_PROMPTS} prompts por lote.'}), 400
+
+        variations = parse_int(data.get('variations'), 1)
+        if variations is None: return jsonify({'error': 'variations deve ser um número inteiro'}), 400
+
+        groups = image_batch.plan_batch(prompts, variations, data.get('aspect_ratio', '1:1'))
+        base_url = request.host_url
+
+        def lines():
+            yield json.dumps({'event': 'start', 'prompts': len(prompts), 'predictions': len(groups)}) + "\n"
+            for result in image_batch.run_batch(user_id, groups):
+                image_ids = result.pop('image_ids', None) or []
+                result['cached'] = [image_store.image_urls(i, base_url) if i else None for i in image_ids]
+                yield json.dumps(dict(result, event='result'), ensure_ascii=False) + "\n"
+            yield json.dumps({'event': 'done'}) + "\n"
+
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except Exception as e: return error_response(e)
+
+@app.route('/replicate-webhook', methods=['POST'])
+def replicate_webhook():
+    body = request.get_data(as_text=True)
+    if not image_jobs.verify_webhook(request.headers, body): return 'Invalid signature', 400
+    try: payload = json.loads(body)
+    except ValueError: return 'Invalid payload', 400
+
+    image_jobs.complete_from_webhook(payload)
+    return 'Success', 200
+
+# --- ROTA: SERVIR IMAGENS DO CACHE LOCAL (ETag, Range e cache longo: o conteúdo nunca muda) ---
+@app.route('/images/<image_id>/<variant>', methods=['GET'])
+def serve_image(image_id, variant):
+    path = image_store.path_for(image_id, variant)
+    if not path: return jsonify({'error': 'Imagem não encontrada'}), 404
+    response = send_file(path, mimetype='image/webp', conditional=True, etag=f"{image_id}-{variant}", max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 # ============================================
 # ROTAS DE HISTÓRICO
 # ============================================
@@ -666,31 +1224,71 @@ def save_history():
         if not all([user_id, tool_type, input_data]):
             return jsonify({"error": "Dados incompletos"}), 400
 
-        response = supabase.table('user_history').insert({
+        # Entra na fila e é gravado no próximo lote (até HISTORY_FLUSH_INTERVAL segundos depois)
+        history_buffer.add({
             "user_id": user_id,
             "tool_type": tool_type,
             "tool_name": tool_name,
             "input_data": input_data,
             "output_data": output_data,
             "metadata": metadata
-        }).execute()
+        })
 
-        return jsonify({"message": "Histórico salvo!", "data": response.data}), 200
+        return jsonify({"success": True, "message": "Histórico salvo!", "queued": True}), 202
     except Exception as e: return jsonify({"error": str(e)}), 500
 
-@app.route('/get-history', methods=['POST'])
+def conditional_json(payload):
+    # ETag do conteúdo: se o cliente já tem essa versão (If-None-Match), devolve 304 sem corpo
+    etag = history.etag_for(payload)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/get-history', methods=['GET', 'POST'])
 def get_history():
     try:
-        data = request.get_json(force=True)
+        data = request.get_json(force=True, silent=True) or request.args.to_dict()
         user_id = data.get('user_id')
         if not user_id: return jsonify({'error': 'user_id obrigatório'}), 400
         
-        query = supabase.table('user_history').select('*').eq('user_id', user_id)
+        # view=list traz só título, ferramenta e prévia; sem view mantém os itens completos (telas antigas)
+        columns = history.LIST_COLUMNS if data.get('view') == 'list' else '*'
+        table = 'user_history_list' if data.get('view') == 'list' else 'user_history'
+        limit = history.page_limit(data.get('limit', history.PAGE_DEFAULT))
+
+        query = supabase.table(table).select(columns).eq('user_id', user_id)
         if data.get('tool_type'): query = query.eq('tool_type', data['tool_type'])
+        try:
+            query = history.apply_cursor(query, data.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        response = query.order('created_at', desc=True).limit(data.get('limit', 100)).execute()
-        return jsonify({'success': True, 'history': response.data})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+        with metrics.stage('supabase', service='supabase'):
+            response = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute()
+        items, next_cursor = history.build_page(response.data or [], limit)
+        return conditional_json({'success': True, 'history': items, 'next_cursor': next_cursor})
+    except Exception as e: return error_response(e)
+
+@app.route('/history/<item_id>', methods=['GET'])
+def get_history_item(item_id):
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id: return jsonify({'error': 'user_id obrigatório'}), 400
+        response = supabase.table('user_history').select('*').eq('id', item_id).eq('user_id', user_id).limit(1).execute()
+        if not response.data: return jsonify({'error': 'Item não encontrado'}), 404
+        return conditional_json({'success': True, 'item': response.data[0]})
+    except Exception as e: return error_response(e)
+
+HISTORY_DELETE_MAX_IDS = 500   # Os ids vão na URL do PostgREST (in.(...)); acima disso, filtro
+HISTORY_DELETE_FILTERS = ('tool_type', 'from', 'to')
+
+def delete_history_rows(user_id):
+    # DELETE ... WHERE user_id = ? já filtra o dono; count=exact com returning=minimal traz só o total apagado
+    return supabase.table('user_history').delete(count='exact', returning='minimal').eq('user_id', user_id)
 
 @app.route('/delete-history-item', methods=['POST'])
 def delete_history_item():
@@ -698,13 +1296,43 @@ def delete_history_item():
         data = request.get_json(force=True)
         user_id = data.get('user_id')
         item_id = data.get('item_id')
+        if not user_id or not item_id: return jsonify({'error': 'Dados incompletos'}), 400
         
-        check = supabase.table('user_history').select('id').eq('id', item_id).eq('user_id', user_id).execute()
-        if not check.data: return jsonify({'error': 'Item não autorizado'}), 404
-        
-        supabase.table('user_history').delete().eq('id', item_id).execute()
+        # Uma ida ao banco: o DELETE só acha a linha se ela for do usuário
+        response = delete_history_rows(user_id).eq('id', item_id).execute()
+        if not response.count: return jsonify({'error': 'Item não autorizado'}), 404
         return jsonify({'success': True})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+    except Exception as e: return error_response(e)
+
+@app.route('/delete-history', methods=['POST'])
+def delete_history():
+    # Apaga vários itens num único DELETE: por ids, por filtro (tool_type, from, to) ou tudo ({"all": true})
+    try:
+        data = request.get_json(force=True)
+        user_id = data.get('user_id')
+        if not user_id: return jsonify({'error': 'user_id obrigatório'}), 400
+
+        ids = data.get('ids') or []
+        filters = data.get('filter') or {}
+        if not isinstance(ids, list) or not isinstance(filters, dict): return jsonify({'error': 'Formato inválido'}), 400
+        if len(ids) > HISTORY_DELETE_MAX_IDS:
+            return jsonify({'error': f'Máximo de {HISTORY_DELETE_MAX_IDS} ids por chamada. Use um filtro para apagar mais.'}), 400
+        unknown = set(filters) - set(HISTORY_DELETE_FILTERS)
+        if unknown: return jsonify({'error': f"Filtro desconhecido: {', '.join(sorted(map(str, unknown)))}"}), 400
+        # Filtro vazio ou só com valores vazios não restringe nada: apagar tudo exige all: true explícito
+        if not ids and not any(filters.get(k) for k in HISTORY_DELETE_FILTERS) and data.get('all') is not True:
+            return jsonify({'error': 'Informe ids, filter (tool_type, from, to) ou all: true'}), 400
+
+        query = delete_history_rows(user_id)
+        if ids: query = query.in_('id', ids)
+        if filters.get('tool_type'): query = query.eq('tool_type', filters['tool_type'])
+        if filters.get('from'): query = query.gte('created_at', filters['from'])
+        if filters.get('to'): query = query.lte('created_at', filters['to'])
+
+        with metrics.stage('supabase', service='supabase'):
+            response = query.execute()
+        return jsonify({'success': True, 'deleted': response.count or 0})
+    except Exception as e: return error_response(e)
 
 # ============================================
 # PAGAMENTOS (STRIPE)
@@ -725,34 +1353,36 @@ def create_checkout_session():
         # 3. Lógica: Se for anual, usa o ID novo. Se não, usa o ID mensal padrão.
         selected_price = yearly_price_id if cycle == 'yearly' else stripe_price
         
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{'price': selected_price, 'quantity': 1}], 
-            mode='subscription', 
-            success_url=f'{frontend_url}/meu-perfil?success=true',
-            cancel_url=f'{frontend_url}/precos?canceled=true',
-            metadata={'user_id': data.get('user_id')},
-            customer_email=data.get('email')
-        )
+        with metrics.stage('stripe', service='stripe'):
+            checkout_session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=[{'price': selected_price, 'quantity': 1}], 
+                mode='subscription', 
+                success_url=f'{frontend_url}/meu-perfil?success=true',
+                cancel_url=f'{frontend_url}/precos?canceled=true',
+                metadata={'user_id': data.get('user_id')},
+                customer_email=data.get('email')
+            )
         return jsonify({'url': checkout_session.url})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+    except Exception as e: return error_response(e)
 
 # ROTA ÚNICA PARA O PORTAL DO CLIENTE
 @app.route('/create-portal-session', methods=['POST'])
 def create_portal_session():
     try:
         user_id = request.json.get('user_id')
-        resp = supabase.table('profiles').select('stripe_customer_id').eq('id', user_id).execute()
+        profile = get_profile(user_id)
         
-        if not resp.data or not resp.data[0].get('stripe_customer_id'):
+        if not profile or not profile.get('stripe_customer_id'):
              return jsonify({'error': 'Sem assinatura ativa para gerenciar.'}), 400
         
-        session = stripe.billing_portal.Session.create(
-            customer=resp.data[0]['stripe_customer_id'],
-            return_url=f'{frontend_url}/meu-perfil',
-        )
+        with metrics.stage('stripe', service='stripe'):
+            session = stripe.billing_portal.Session.create(
+                customer=profile['stripe_customer_id'],
+                return_url=f'{frontend_url}/meu-perfil',
+            )
         return jsonify({'url': session.url})
-    except Exception as e: return jsonify({'error': str(e)}), 500
+    except Exception as e: return error_response(e)
 
 @app.route('/webhook', methods=['POST'])
 def stripe_webhook():
@@ -765,7 +1395,8 @@ def stripe_webhook():
     except stripe.error.SignatureVerificationError as e: return 'Invalid signature', 400
 
     if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
+        # stripe>=15: StripeObject não tem .get(); converte para dict
+        session = event['data']['object'].to_dict()
         uid = session.get('metadata', {}).get('user_id')
         if uid: 
             supabase.table('profiles').update({
@@ -773,16 +1404,22 @@ def stripe_webhook():
                 'stripe_customer_id': session.get('customer'),
                 'credits': 100 
             }).eq('id', uid).execute()
+            # Todos os workers passam a ler o perfil novo (is_pro) na próxima requisição
+            profile_cache.invalidate(uid)
             
     elif event['type'] == 'customer.subscription.deleted':
-        sub = event['data']['object']
+        sub = event['data']['object'].to_dict()
         cus_id = sub.get('customer')
         resp = supabase.table('profiles').select('id').eq('stripe_customer_id', cus_id).execute()
         if resp.data: 
             supabase.table('profiles').update({'is_pro': False}).eq('id', resp.data[0]['id']).execute()
+            profile_cache.invalidate(resp.data[0]['id'])
             
     return 'Success', 200
 
+# Pré-carrega no boot do worker as bibliotecas listadas em WARMUP_TOOLS (ex.: gemini,supabase)
+lazy_tools.warmup(os.environ.get('WARMUP_TOOLS'))
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
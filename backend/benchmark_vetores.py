@@ -0,0 +1,43 @@
+import time
+import numpy as np
+from vector_index import VectorIndex
+
+# Mede a latência da busca top-k do índice vetorial com 1k, 10k e 100k trechos
+DIM = 768
+K = 6
+REPETICOES = 200
+
+def gerar_trechos(n, documentos=50):
+    rng = np.random.default_rng(42)
+    vetores = rng.standard_normal((n, DIM), dtype=np.float32)
+    return [{
+        'source_id': i % documentos,
+        'chunk_index': i,
+        'content': f"trecho {i}",
+        'embedding': vetores[i]
+    } for i in range(n)]
+
+print("\n--- BENCHMARK DO ÍNDICE VETORIAL ---")
+print(f"{'trechos':>10} {'carga (s)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'filtro doc p50 (ms)':>20}")
+
+for n in (1_000, 10_000, 100_000):
+    trechos = gerar_trechos(n)
+    index = VectorIndex(lambda user_id: trechos, max_bytes=4 * 1024 ** 3)
+
+    inicio = time.perf_counter()
+    index.search('usuario', trechos[0]['embedding'], k=K)
+    carga = time.perf_counter() - inicio
+
+    consultas = np.random.default_rng(7).standard_normal((REPETICOES, DIM), dtype=np.float32)
+    tempos, tempos_filtro = [], []
+    for q in consultas:
+        t = time.perf_counter()
+        index.search('usuario', q, k=K)
+        tempos.append((time.perf_counter() - t) * 1000)
+        t = time.perf_counter()
+        index.search('usuario', q, k=K, source_id=3)
+        tempos_filtro.append((time.perf_counter() - t) * 1000)
+
+    print(f"{n:>10} {carga:>10.2f} {np.percentile(tempos, 50):>10.3f} {np.percentile(tempos, 95):>10.3f} {np.percentile(tempos_filtro, 50):>20.3f}")
+
+print("------------------------------------\n")
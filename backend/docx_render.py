@@ -0,0 +1,234 @@
+# --- MARKDOWN -> DOCX (FORMATAÇÃO ABNT) ---
+# O documento-base com os estilos ABNT é montado uma vez por worker e guardado como bytes;
+# cada requisição só abre uma cópia dele e acrescenta os parágrafos.
+import io
+import re
+
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+from docx.shared import Cm, Pt, RGBColor
+from docx.text.paragraph import Paragraph
+
+FONT_NAME = 'Times New Roman'
+CODE_FONT = 'Courier New'
+TABLE_TEXT_STYLE = 'Texto da Tabela'
+
+_HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_BULLET_RE = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+_NUMBERED_RE = re.compile(r'^(\s*)(\d+[.)])\s+(.*)$')
+_TABLE_SEP_RE = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+_RULE_RE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+_INLINE_RE = re.compile(r'(\*\*.+?\*\*|(?<!\w)__.+?__(?!\w)|\*[^*\s][^*]*?\*|(?<!\w)_[^_\s][^_]*?_(?!\w)|`[^`]+`)')
+
+_base_bytes = None
+
+
+def _set_font(style, size, bold=None, italic=None):
+    style.font.name = FONT_NAME
+    style.font.size = Pt(size)
+    style.font.color.rgb = RGBColor(0, 0, 0)
+    if bold is not None: style.font.bold = bold
+    if italic is not None: style.font.italic = italic
+    # Sem isso o Word ignora a fonte em textos com acentos/asiáticos
+    rpr = style.element.get_or_add_rPr()
+    rpr.get_or_add_rFonts().set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}eastAsia', FONT_NAME)
+
+def _build_base():
+    # Margens, fonte e espaçamentos da ABNT (NBR 14724)
+    doc = Document()
+    for section in doc.sections:
+        section.page_height, section.page_width = Cm(29.7), Cm(21)
+        section.top_margin = section.left_margin = Cm(3)
+        section.bottom_margin = section.right_margin = Cm(2)
+
+    styles = doc.styles
+    normal = styles['Normal']
+    _set_font(normal, 12)
+    fmt = normal.paragraph_format
+    fmt.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    fmt.line_spacing = 1.5
+    fmt.first_line_indent = Cm(1.25)
+    fmt.space_before = fmt.space_after = Pt(0)
+
+    for level in range(1, 7):
+        heading = styles[f'Heading {level}']
+        _set_font(heading, 12, bold=level <= 2, italic=level >= 4)
+        heading.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        heading.paragraph_format.first_line_indent = Cm(0)
+        heading.paragraph_format.space_before = Pt(12)
+        heading.paragraph_format.space_after = Pt(12)
+    _set_font(styles['Title'], 12, bold=True)
+    styles['Title'].paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    for name in ('List Bullet', 'List Number', 'List Paragraph'):
+        styles[name].paragraph_format.first_line_indent = Cm(0)
+
+    # Citação longa: recuo de 4 cm, fonte 10, espaço simples
+    quote = styles['Quote']
+    _set_font(quote, 10, italic=False)
+    quote.paragraph_format.left_indent = Cm(4)
+    quote.paragraph_format.first_line_indent = Cm(0)
+    quote.paragraph_format.line_spacing_rule = WD_LINE_SPACING.SINGLE
+    quote.paragraph_format.space_after = Pt(12)
+
+    # Texto das células: sem recuo de primeira linha, alinhado à esquerda, espaço simples
+    cell = styles.add_style(TABLE_TEXT_STYLE, WD_STYLE_TYPE.PARAGRAPH)
+    cell.base_style = normal
+    cell.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
+    cell.paragraph_format.first_line_indent = Cm(0)
+    cell.paragraph_format.line_spacing_rule = WD_LINE_SPACING.SINGLE
+
+    code = styles['No Spacing']
+    code.font.name = CODE_FONT
+    code.font.size = Pt(10)
+
+    f = io.BytesIO()
+    doc.save(f)
+    return f.getvalue()
+
+def new_document():
+    # Cópia barata do documento-base (só lê os bytes já montados)
+    global _base_bytes
+    if _base_bytes is None: _base_bytes = _build_base()
+    return Document(io.BytesIO(_base_bytes))
+
+def _add_inline(paragraph, text):
+    for part in _INLINE_RE.split(text):
+        if not part: continue
+        if part[:2] in ('**', '__') and part[-2:] == part[:2] and len(part) > 4:
+            paragraph.add_run(part[2:-2]).bold = True
+        elif part[0] in '*_' and part[-1] == part[0] and len(part) > 2:
+            paragraph.add_run(part[1:-1]).italic = True
+        elif part[0] == '`' and part[-1] == '`' and len(part) > 2:
+            paragraph.add_run(part[1:-1]).font.name = CODE_FONT
+        else:
+            paragraph.add_run(part)
+
+def _split_row(line):
+    line = line.strip()
+    if line.startswith('|'): line = line[1:]
+    if line.endswith('|'): line = line[:-1]
+    return [cell.strip() for cell in line.split('|')]
+
+def _add_table(doc, header, rows, style_id):
+    cols = len(header)
+    table = doc.add_table(rows=0, cols=cols)
+    table.style = 'Table Grid'
+    for r, values in enumerate([header] + rows):
+        # Vai direto nos <w:tc> da linha nova: table.cell()/row.cells recalculam a grade da tabela a cada chamada
+        tr = table.add_row()._tr
+        for c, tc in enumerate(tr.tc_lst):
+            paragraph = Paragraph(tc.p_lst[0], table)
+            paragraph._p.get_or_add_pPr().style = style_id
+            _add_inline(paragraph, values[c] if c < len(values) else '')
+            if r == 0:
+                for run in paragraph.runs: run.bold = True
+
+def render_markdown(markdown_text, doc=None):
+    # Converte Markdown (títulos, listas, tabelas, citações, código) em parágrafos com os estilos do documento-base
+    doc = doc or new_document()
+    styles = doc.styles
+    body = doc._body
+    # O python-docx resolve o estilo pelo nome (e procura o estilo padrão) a cada parágrafo;
+    # guardamos o style_id de cada estilo e gravamos direto no XML do parágrafo
+    style_ids = {}
+    def style_id(name):
+        if name not in style_ids: style_ids[name] = styles[name].style_id
+        return style_ids[name]
+    def add_paragraph(name, text=None):
+        paragraph = body.add_paragraph(text)
+        if name != 'Normal': paragraph._p.get_or_add_pPr().style = style_id(name)
+        return paragraph
+
+    lines = (markdown_text or '').replace('\r\n', '\n').split('\n')
+    paragraph_lines = []
+
+    def flush_paragraph():
+        if paragraph_lines:
+            _add_inline(add_paragraph('Normal'), " ".join(paragraph_lines))
+            paragraph_lines.clear()
+
+    i, total = 0, len(lines)
+    while i < total:
+        line = lines[i]
+        stripped = line.strip()
+
+        if not stripped:
+            flush_paragraph()
+            i += 1
+            continue
+
+        if stripped.startswith('```'):
+            flush_paragraph()
+            i += 1
+            while i < total and not lines[i].strip().startswith('```'):
+                add_paragraph('No Spacing', lines[i])
+                i += 1
+            i += 1
+            continue
+
+        heading = _HEADING_RE.match(stripped)
+        if heading:
+            flush_paragraph()
+            _add_inline(add_paragraph(f'Heading {len(heading.group(1))}'), heading.group(2))
+            i += 1
+            continue
+
+        if _RULE_RE.match(stripped):
+            flush_paragraph()
+            doc.add_page_break()
+            i += 1
+            continue
+
+        if '|' in stripped and i + 1 < total and _TABLE_SEP_RE.match(lines[i + 1]):
+            flush_paragraph()
+            header = _split_row(stripped)
+            rows = []
+            i += 2
+            while i < total and '|' in lines[i] and lines[i].strip():
+                rows.append(_split_row(lines[i]))
+                i += 1
+            _add_table(doc, header, rows, style_id(TABLE_TEXT_STYLE))
+            continue
+
+        if stripped.startswith('>'):
+            flush_paragraph()
+            quote = []
+            while i < total and lines[i].strip().startswith('>'):
+                quote.append(lines[i].strip()[1:].strip())
+                i += 1
+            _add_inline(add_paragraph('Quote'), " ".join(quote))
+            continue
+
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            flush_paragraph()
+            paragraph = add_paragraph('List Bullet')
+            paragraph.paragraph_format.left_indent = Cm(0.63 * (1 + len(bullet.group(1)) // 2))
+            _add_inline(paragraph, bullet.group(2))
+            i += 1
+            continue
+
+        numbered = _NUMBERED_RE.match(line)
+        if numbered:
+            flush_paragraph()
+            # Mantém o número escrito no texto: o List Number do Word continuaria a contagem entre listas
+            paragraph = add_paragraph('List Paragraph')
+            paragraph.paragraph_format.left_indent = Cm(0.63 * (1 + len(numbered.group(1)) // 2))
+            paragraph.add_run(numbered.group(2) + ' ')
+            _add_inline(paragraph, numbered.group(3))
+            i += 1
+            continue
+
+        paragraph_lines.append(stripped)
+        i += 1
+
+    flush_paragraph()
+    return doc
+
+def render_docx_bytes(markdown_text):
+    f = io.BytesIO()
+    render_markdown(markdown_text).save(f)
+    f.seek(0)
+    return f
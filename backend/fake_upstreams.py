@@ -0,0 +1,310 @@
+# --- SERVIÇOS EXTERNOS FALSOS (GEMINI, SUPABASE, REPLICATE, STRIPE) ---
+# Um servidor HTTP local que responde no formato de cada API, com latência sorteada
+# (distribuição log-normal a partir da mediana e do p95) e uma taxa de falhas configurável.
+# Usado pelo load_test.py; também roda sozinho para testes manuais:
+#
+#   python fake_upstreams.py 8900
+#   FAKE_GEMINI="median=0.8,p95=3,fail=0.02" python fake_upstreams.py 8900
+#
+# Variáveis FAKE_<SERVIÇO> = "median=<s>,p95=<s>,fail=<0..1>" (GEMINI, SUPABASE, REPLICATE, STRIPE).
+import io
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EMBEDDING_DIM = 768
+DEFAULT_PROFILES = {
+    'gemini': {'median': 1.0, 'p95': 3.0, 'fail': 0.0},
+    'supabase': {'median': 0.03, 'p95': 0.12, 'fail': 0.0},
+    'replicate': {'median': 2.0, 'p95': 5.0, 'fail': 0.0},
+    'stripe': {'median': 0.3, 'p95': 0.8, 'fail': 0.0},
+    'files': {'median': 0.05, 'p95': 0.2, 'fail': 0.0},
+}
+TEXT_WORDS = int(os.environ.get('FAKE_GEMINI_WORDS', 200))
+STREAM_CHUNKS = 5
+
+
+class ServiceProfile:
+    def __init__(self, median, p95, fail=0.0):
+        self.median = float(median)
+        self.p95 = max(float(p95), self.median)
+        self.fail = float(fail)
+        # p95 de uma log-normal = mediana * e^(1,645 * sigma)
+        self.sigma = math.log(self.p95 / self.median) / 1.645 if self.median > 0 else 0.0
+
+    @classmethod
+    def parse(cls, text, base):
+        values = dict(base)
+        for part in filter(None, (text or '').split(',')):
+            name, _, value = part.partition('=')
+            values[name.strip()] = float(value)
+        return cls(values['median'], values['p95'], values.get('fail', 0.0))
+
+    def latency(self):
+        if self.median <= 0: return 0.0
+        return self.median * math.exp(self.sigma * random.gauss(0, 1))
+
+    def fails(self):
+        return random.random() < self.fail
+
+    def as_dict(self):
+        return {'median': self.median, 'p95': self.p95, 'fail': self.fail}
+
+
+def load_profiles(overrides=None):
+    profiles = {}
+    for name, base in DEFAULT_PROFILES.items():
+        text = (overrides or {}).get(name) or os.environ.get(f'FAKE_{name.upper()}')
+        profiles[name] = ServiceProfile.parse(text, base)
+    return profiles
+
+
+def _lorem(words, seed):
+    rng = random.Random(seed)
+    vocab = ('dados', 'estudo', 'resumo', 'texto', 'carreira', 'empresa', 'projeto', 'aluno', 'vídeo', 'análise',
+             'resultado', 'ideia', 'mercado', 'equipe', 'processo', 'modelo', 'pergunta', 'resposta', 'tema', 'norma')
+    return " ".join(rng.choice(vocab) for _ in range(words))
+
+def gemini_text(prompt):
+    # Respostas com o formato que cada rota espera do modelo
+    if 'Gerador de Dados para Excel' in prompt:
+        match = re.search(r'JSON com (\d+) linhas', prompt)
+        rows = int(match.group(1)) if match else 5
+        return json.dumps([{'Nome': f'Item {i}', 'Valor': i * 10, 'Categoria': 'A' if i % 2 else 'B'} for i in range(rows)], ensure_ascii=False)
+    if '"total_score"' in prompt:
+        return '```json\n{"total_score": 820, "competencies": {"c1": 160}, "feedback": "Bom texto."}\n```'
+    if '"questions"' in prompt:
+        return '{"questions": [{"q": "Fale de você.", "a": "Resumo da carreira."}], "tips": ["Chegue cedo."]}'
+    return _lorem(TEXT_WORDS, prompt[:200])
+
+def _prompt_from(body):
+    try:
+        return " ".join(part.get('text', '') for content in body.get('contents', []) for part in content.get('parts', []))
+    except Exception:
+        return ''
+
+def _candidate(text):
+    return {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP', 'index': 0}]}
+
+def _vector(seed):
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]
+
+
+def _tiny_webp(seed):
+    from PIL import Image
+    rng = random.Random(seed)
+    img = Image.new('RGB', (64, 64), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    out = io.BytesIO()
+    img.save(out, 'WEBP', quality=80)
+    return out.getvalue()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # --- utilitários ---
+    def _body(self):
+        length = int(self.headers.get('content-length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _send(self, status, payload=None, content_type='application/json', headers=None):
+        data = payload if isinstance(payload, bytes) else (b'' if payload is None else json.dumps(payload).encode())
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items(): self.send_header(name, value)
+        self.end_headers()
+        if data and self.command != 'HEAD': self.wfile.write(data)
+
+    def _service(self):
+        path = self.path
+        if path.startswith('/rest/v1/'): return 'supabase'
+        if path.startswith('/v1beta/'): return 'gemini'
+        if path.startswith('/v1/models/') or path.startswith('/v1/predictions'): return 'replicate'
+        if path.startswith('/v1/'): return 'stripe'
+        return 'files'
+
+    def _handle(self):
+        service = self._service()
+        profile = self.server.profiles[service]
+        body = self._body()
+        self.server.count(service)
+        if profile.fails():
+            time.sleep(profile.latency() * 0.2)
+            return self._fail(service)
+        delay = profile.latency()
+        if service == 'gemini' and ':streamGenerateContent' in self.path:
+            return self._gemini_stream(body, delay)
+        time.sleep(delay)
+        getattr(self, f'_{service}')(body)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _handle
+
+    def _fail(self, service):
+        self.server.count(f'{service}_falhas')
+        if service == 'gemini':
+            return self._send(503, {'error': {'code': 503, 'message': 'Falha simulada', 'status': 'UNAVAILABLE'}})
+        if service == 'stripe':
+            return self._send(500, {'error': {'type': 'api_error', 'message': 'Falha simulada'}})
+        return self._send(503, {'message': 'Falha simulada', 'detail': 'Falha simulada'})
+
+    # --- Gemini (REST v1beta) ---
+    def _gemini(self, body):
+        if ':batchEmbedContents' in self.path:
+            requests = body.get('requests', [])
+            return self._send(200, {'embeddings': [{'values': _vector(i)} for i in range(len(requests))]})
+        if ':embedContent' in self.path:
+            return self._send(200, {'embedding': {'values': _vector(_prompt_from({'contents': [body.get('content', {})]}))}})
+        return self._send(200, _candidate(gemini_text(_prompt_from(body))))
+
+    def _gemini_stream(self, body, delay):
+        # Array JSON enviado aos poucos (chunked): 30% da latência até o primeiro pedaço, o resto entre pedaços
+        text = gemini_text(_prompt_from(body))
+        size = max(1, math.ceil(len(text) / STREAM_CHUNKS))
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        time.sleep(delay * 0.3)
+        for i, piece in enumerate(pieces):
+            chunk = ('[' if i == 0 else ',') + json.dumps(_candidate(piece))
+            if i == len(pieces) - 1: chunk += ']'
+            data = chunk.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            if i < len(pieces) - 1: time.sleep(delay * 0.7 / len(pieces))
+        self.wfile.write(b"0\r\n\r\n")
+
+    # --- Supabase (PostgREST) ---
+    def _supabase(self, body):
+        url = urlparse(self.path)
+        table = url.path[len('/rest/v1/'):]
+        query = parse_qs(url.query)
+        if table == 'rpc/consume_credit':
+            return self._send(200, [{'credits': 99, 'is_pro': False, 'charged': True}])
+        if self.command == 'DELETE':
+            # Apagar por id sempre acha o item; filtros apagam alguns
+            deleted = 1 if query.get('id', [''])[0].startswith('eq.') else random.randint(0, 5)
+            return self._send(204, headers={'Content-Range': f'*/{deleted}'})
+        if self.command in ('POST', 'PATCH'):
+            rows = body if isinstance(body, list) else [body]
+            rows = [dict(row, id=row.get('id') or random.randint(1, 10 ** 9)) for row in rows]
+            return self._send(201 if self.command == 'POST' else 200, rows)
+        limit = int(query.get('limit', ['20'])[0])
+        offset = int((self.headers.get('Range') or '0-').split('-')[0] or 0)
+        return self._send(200, self._rows(table, query, limit, offset))
+
+    def _rows(self, table, query, limit, offset):
+        user_id = (query.get('user_id', ['eq.carga'])[0] or 'eq.carga').split('.', 1)[-1]
+        now = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
+        if table == 'profiles':
+            return [{'id': user_id, 'credits': 99, 'is_pro': False, 'stripe_customer_id': 'cus_falso'}]
+        if table == 'documents':
+            if 'chunk_count' in query: return []     # Nunca acha duplicata: todo upload passa pela indexação
+            return [{'id': 1, 'content_hash': 'hash-carga', 'content': _lorem(400, 'doc'), 'chunk_count': 20, 'user_id': user_id}]
+        if table == 'document_chunks':
+            if offset: return []
+            return [{'document_id': 1, 'content_hash': 'hash-carga', 'chunk_index': i, 'content': _lorem(120, i),
+                     'embedding': _vector(i)} for i in range(20)]
+        if table in ('user_history', 'user_history_list'):
+            rows = []
+            for i in range(min(limit, 20)):
+                row = {'id': 10 ** 6 - i, 'user_id': user_id, 'tool_type': 'study', 'tool_name': 'Gerador de Material de Estudo',
+                       'created_at': now, 'title': 'Material', 'input_preview': 'tema', 'output_preview': _lorem(30, i)}
+                if table == 'user_history':
+                    row.update({'input_data': 'tema', 'output_data': _lorem(300, i), 'metadata': {}})
+                rows.append(row)
+            return rows
+        return []
+
+    # --- Replicate ---
+    def _replicate(self, body):
+        base = f"http://{self.headers.get('Host')}"
+        prediction_id = self.path.rstrip('/').split('/')[-1] if self.path.startswith('/v1/predictions/') else uuid.uuid4().hex
+        outputs = int((body.get('input') or {}).get('num_outputs', 1))
+        # replicate_pending: a criação devolve 'starting' e só a consulta (GET) vem pronta
+        pending = self.server.replicate_pending and self.command == 'POST'
+        return self._send(201 if self.command == 'POST' else 200, {
+            'id': prediction_id, 'model': 'black-forest-labs/flux-schnell', 'version': 'falsa',
+            'status': 'starting' if pending else 'succeeded', 'input': body.get('input', {}),
+            'output': None if pending else [f"{base}/arquivos/{prediction_id}-{i}.webp" for i in range(outputs)],
+            'error': None, 'logs': '', 'created_at': '2026-01-01T00:00:00Z', 'urls': {'get': f"{base}/v1/predictions/{prediction_id}"}
+        })
+
+    # --- Stripe ---
+    def _stripe(self, body):
+        kind = 'billing_portal.session' if 'billing_portal' in self.path else 'checkout.session'
+        session_id = f"cs_{uuid.uuid4().hex[:16]}"
+        return self._send(200, {'id': session_id, 'object': kind, 'url': f"https://stripe.falso/{session_id}"})
+
+    # --- Arquivos (imagens do Replicate) ---
+    def _files(self, body):
+        if self.path.startswith('/arquivos/'):
+            return self._send(200, _tiny_webp(self.path), content_type='image/webp')
+        return self._send(404, {'error': 'não encontrado'})
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeUpstreams(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, profiles=None):
+        super().__init__(('127.0.0.1', port), FakeHandler)
+        self.profiles = profiles or load_profiles()
+        self.replicate_pending = False
+        self.counts = {}
+        self._counts_lock = threading.Lock()
+
+    def count(self, name):
+        with self._counts_lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def handle_error(self, request, client_address):
+        # Conexões fechadas pelo cliente no fim do teste não interessam
+        pass
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def env(self):
+        # Variáveis que fazem o app.py falar com este servidor em vez dos serviços reais
+        return {
+            'SUPABASE_URL': self.url, 'SUPABASE_KEY': 'chave-falsa',
+            'GOOGLE_API_KEY': 'chave-falsa', 'GEMINI_TRANSPORT': 'rest', 'GEMINI_API_ENDPOINT': self.url,
+            'REPLICATE_API_TOKEN': 'r8_falso', 'REPLICATE_API_BASE': self.url, 'REPLICATE_BASE_URL': self.url,
+            'REPLICATE_POLL_INTERVAL': '0.1', 'IMAGE_ALLOWED_HOSTS': '127.0.0.1',
+            'STRIPE_SECRET_KEY': 'sk_test_falso', 'STRIPE_API_BASE': self.url, 'STRIPE_PRICE_ID': 'price_falso',
+            'FRONTEND_URL': 'http://frontend.falso',
+        }
+
+
+if __name__ == '__main__':
+    server = FakeUpstreams(int(sys.argv[1]) if len(sys.argv) > 1 else 8900).start()
+    print(f"Serviços falsos em {server.url}")
+    for name, profile in server.profiles.items(): print(f"  {name:>9}: {profile.as_dict()}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,254 @@
+# --- CHAMADAS AO GEMINI COM PRAZO, RETENTATIVAS, HEDGE E MODELO RESERVA ---
+# Toda chamada ao modelo passa por aqui:
+#   - prazo por rota (GEMINI_DEADLINE e GEMINI_DEADLINES): nenhuma chamada segura o worker além dele;
+#   - erros passageiros (429, 5xx, timeout, rede) são repetidos com espera aleatória (backoff com jitter);
+#   - circuit breaker por modelo: depois de GEMINI_BREAKER_FAILURES falhas seguidas o modelo fica
+#     GEMINI_BREAKER_COOLDOWN segundos sem receber chamadas (depois uma chamada de teste reabre);
+#   - modelo reserva (GEMINI_FALLBACK_MODEL, mais barato e rápido) quando o principal falha ou está aberto;
+#   - hedge opcional (GEMINI_HEDGE=1): se a chamada passar do p95 recente, uma segunda igual é disparada
+#     e vale a que responder primeiro. Só nas chamadas sem streaming.
+#
+# Cada decisão vira métrica (adapta_gemini_*) no /metrics.
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+DEADLINE = float(os.environ.get('GEMINI_DEADLINE', 60))
+MAX_ATTEMPTS = int(os.environ.get('GEMINI_MAX_ATTEMPTS', 3))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+BREAKER_FAILURES = int(os.environ.get('GEMINI_BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = float(os.environ.get('GEMINI_BREAKER_COOLDOWN', 30))
+HEDGE = os.environ.get('GEMINI_HEDGE') == '1'
+HEDGE_MIN_SAMPLES = 20        # Só faz hedge depois de conhecer a latência do modelo
+HEDGE_MIN_DELAY = 1.0         # Nunca antes disso, mesmo que o p95 seja menor
+LATENCY_WINDOW = 200
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def parse_deadlines(text):
+    # "/summarize-video=90,/generate-prompt=20" -> {'/summarize-video': 90.0, ...}
+    deadlines = {}
+    for part in filter(None, (text or '').split(',')):
+        route, _, seconds = part.partition('=')
+        deadlines[route.strip()] = float(seconds)
+    return deadlines
+
+DEADLINES = parse_deadlines(os.environ.get('GEMINI_DEADLINES'))
+
+
+class ModelUnavailable(Exception):
+    # Prazo esgotado, tentativas esgotadas ou breaker aberto: o app responde 503 com Retry-After
+    retry_after = 10
+
+
+def is_retryable(error):
+    # Erros da API do Google têm .code (HTTP); erros sem código são de rede/timeout e valem nova tentativa
+    code = getattr(error, 'code', None)
+    if isinstance(code, int): return code in RETRYABLE_CODES
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+class CircuitBreaker:
+    def __init__(self, model_name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.model_name = model_name
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._errors = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._opened_at is None: return 'closed'
+        return 'half_open' if time.monotonic() - self._opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed': return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True    # Uma única chamada de teste por vez
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None: metrics.inc('gemini_breaker_transitions_total', model=self.model_name, state='closed')
+            self._errors, self._opened_at, self._probing = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self._errors += 1
+            if self._probing or (self._opened_at is None and self._errors >= self.failures):
+                metrics.inc('gemini_breaker_transitions_total', model=self.model_name, state='open')
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def end_probe(self):
+        # Chamado sempre ao fim de uma tentativa (finally): se a chamada de teste não terminou em
+        # success()/failure() (cliente desconectou no meio do stream), volta a aberto com nova espera
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self._opened_at = time.monotonic()
+
+
+class GeminiClient:
+    def __init__(self, primary, fallback, make_model, hedge=HEDGE):
+        # make_model(nome) devolve um GenerativeModel (criado sob demanda pelo app)
+        self.primary = primary
+        self.fallback = fallback or None
+        self._make_model = make_model
+        self._models = {}
+        self._lock = threading.Lock()
+        self.breakers = {name: CircuitBreaker(name) for name in filter(None, (primary, self.fallback))}
+        self._latencies = {name: deque(maxlen=LATENCY_WINDOW) for name in self.breakers}
+        self.hedge = hedge
+        self._executor = ThreadPoolExecutor(max_workers=int(os.environ.get('GEMINI_HEDGE_THREADS', 32)),
+                                            thread_name_prefix='gemini') if hedge else None
+
+    def _model(self, name):
+        with self._lock:
+            if name not in self._models: self._models[name] = self._make_model(name)
+            return self._models[name]
+
+    def deadline_for(self, route):
+        # Rotas com sufixo (ex.: /summarize-video:summary) herdam o prazo da rota
+        route = route or ''
+        return DEADLINES.get(route, DEADLINES.get(route.split(':')[0], DEADLINE))
+
+    def _choose(self, attempt):
+        # Principal enquanto o breaker deixar (a última tentativa fica para o reserva); depois o reserva
+        use_primary = attempt < max(1, MAX_ATTEMPTS - 1) or not self.fallback
+        if use_primary and self.breakers[self.primary].allow(): return self.primary
+        if self.fallback and self.breakers[self.fallback].allow():
+            metrics.inc('gemini_fallbacks_total', model=self.fallback,
+                        reason='breaker_open' if use_primary else 'primary_failed')
+            return self.fallback
+        metrics.inc('gemini_calls_total', model=self.primary, outcome='rejected')
+        raise ModelUnavailable("Modelo indisponível no momento, tente de novo em instantes.")
+
+    def _failed(self, name, error):
+        # Só erros passageiros contam para o breaker. Prompt inválido (400) ou resposta bloqueada
+        # quer dizer que o modelo respondeu: conta como sucesso e fecha o breaker.
+        if is_retryable(error): self.breakers[name].failure()
+        else: self.breakers[name].success()
+        metrics.inc('gemini_calls_total', model=name, outcome=self._outcome(error))
+
+    def _backoff(self, attempt, deadline):
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        if time.monotonic() + delay >= deadline: return False
+        metrics.inc('gemini_retries_total')
+        time.sleep(delay)
+        return True
+
+    def _p95(self, name):
+        samples = sorted(self._latencies[name])
+        if len(samples) < HEDGE_MIN_SAMPLES: return None
+        return max(samples[int(0.95 * (len(samples) - 1))], HEDGE_MIN_DELAY)
+
+    def _call(self, name, prompt, generation_config, timeout):
+        start = time.perf_counter()
+        with metrics.upstream('gemini'):
+            response = self._model(name).generate_content(
+                prompt, generation_config=generation_config, request_options={'timeout': timeout})
+        self._latencies[name].append(time.perf_counter() - start)
+        return response.text
+
+    def _call_hedged(self, name, prompt, generation_config, deadline):
+        hedge_after = self._p95(name)
+        timeout = deadline - time.monotonic()
+        if not self.hedge or hedge_after is None or hedge_after >= timeout:
+            return self._call(name, prompt, generation_config, timeout)
+        first = self._executor.submit(self._call, name, prompt, generation_config, timeout)
+        done, _ = wait([first], timeout=hedge_after)
+        if done: return first.result()
+        metrics.inc('gemini_hedges_total', model=name, outcome='sent')
+        second = self._executor.submit(self._call, name, prompt, generation_config, deadline - time.monotonic())
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done: raise TimeoutError("Prazo da chamada ao Gemini esgotado.")
+            for future in done:
+                if future.exception() is None:
+                    metrics.inc('gemini_hedges_total', model=name, outcome='won' if future is second else 'lost')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def generate(self, prompt, generation_config=None, route=None):
+        # Devolve (texto, modelo que respondeu)
+        deadline = time.monotonic() + self.deadline_for(route)
+        error = None
+        for attempt in range(MAX_ATTEMPTS):
+            if deadline - time.monotonic() <= 0: break
+            name = self._choose(attempt)
+            try:
+                text = self._call_hedged(name, prompt, generation_config, deadline)
+            except Exception as e:
+                error = e
+                self._failed(name, e)
+                if not is_retryable(e): raise
+                if not self._backoff(attempt, deadline): break
+                continue
+            else:
+                self.breakers[name].success()
+                metrics.inc('gemini_calls_total', model=name, outcome='ok')
+                return text, name
+            finally:
+                self.breakers[name].end_probe()
+        raise ModelUnavailable("Modelo indisponível no momento, tente de novo em instantes.") from error
+
+    def stream(self, prompt, generation_config=None, route=None):
+        # Gera (pedaço, modelo). Repete/troca de modelo só antes do primeiro pedaço: depois disso o
+        # cliente já recebeu texto e um erro é repassado. O prazo vale para o stream inteiro.
+        deadline = time.monotonic() + self.deadline_for(route)
+        error = None
+        for attempt in range(MAX_ATTEMPTS):
+            if deadline - time.monotonic() <= 0: break
+            name = self._choose(attempt)
+            started = False
+            try:
+                with metrics.upstream('gemini'):
+                    response = self._model(name).generate_content(
+                        prompt, generation_config=generation_config, stream=True,
+                        request_options={'timeout': deadline - time.monotonic()})
+                    for chunk in response:
+                        if time.monotonic() > deadline: raise TimeoutError("Prazo da chamada ao Gemini esgotado.")
+                        piece = chunk.text
+                        if piece:
+                            started = True
+                            yield piece, name
+            except Exception as e:
+                error = e
+                self._failed(name, e)
+                if started or not is_retryable(e): raise
+                if not self._backoff(attempt, deadline): break
+                continue
+            except GeneratorExit:
+                # Cliente abandonou o stream: se já chegou texto o modelo está respondendo
+                if started: self.breakers[name].success()
+                raise
+            else:
+                self.breakers[name].success()
+                metrics.inc('gemini_calls_total', model=name, outcome='ok')
+                return
+            finally:
+                self.breakers[name].end_probe()
+        raise ModelUnavailable("Modelo indisponível no momento, tente de novo em instantes.") from error
+
+    @staticmethod
+    def _outcome(error):
+        if 'timeout' in type(error).__name__.lower() or getattr(error, 'code', None) in (408, 504): return 'timeout'
+        return 'retryable_error' if is_retryable(error) else 'error'
+
+    def stats(self):
+        return {name: {'state': breaker.state, 'p95': self._p95(name)} for name, breaker in self.breakers.items()}
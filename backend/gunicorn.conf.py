@@ -0,0 +1,34 @@
+# --- PERFIL DE WORKERS DO GUNICORN ---
+# O gunicorn lê este arquivo sozinho quando roda nesta pasta: gunicorn wsgi:app
+#
+# Quase todo o tempo de uma requisição é espera de rede (Gemini, Replicate, Supabase, Stripe).
+# Por isso o padrão não é mais 1 requisição por processo:
+#
+#   gthread (padrão)  -> WEB_CONCURRENCY processos x GUNICORN_THREADS threads cada.
+#                        2 x 128 = 256 chamadas ao modelo em paralelo com a memória de ~2 processos.
+#                        As threads só esperam rede, então o GIL não é o gargalo.
+#   sync              -> modo antigo (1 requisição por processo), só para comparação no load_test.py.
+#
+# Exemplo na Render:  WEB_CONCURRENCY=2 GUNICORN_THREADS=128 gunicorn wsgi:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(2 * multiprocessing.cpu_count(), 4)))
+
+if worker_class == 'gthread':
+    threads = int(os.environ.get('GUNICORN_THREADS', 128))
+
+# Chamadas longas ao modelo não devem derrubar o worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+
+def worker_exit(server, worker):
+    # Grava o que ainda estiver na fila do histórico antes do worker sair (reinício, deploy, max_requests)
+    import sys
+    writer = sys.modules.get('history_writer')
+    if writer: writer.close_all()
@@ -0,0 +1,83 @@
+# --- HISTÓRICO: PAGINAÇÃO POR CURSOR ---
+# As páginas andam por (created_at, id) em ordem decrescente: cada página é uma consulta
+# pelo índice a partir do último item visto, sem OFFSET e sem pular/repetir itens novos.
+import base64
+import hashlib
+import json
+import os
+
+LIST_COLUMNS = 'id, tool_type, tool_name, title, input_preview, output_preview, created_at'
+PAGE_DEFAULT = 100       # Mesmo padrão de antes do cursor
+PAGE_MAX = 100
+PAGE_MAX_BYTES = int(os.environ.get('HISTORY_PAGE_MAX_KB', 256)) * 1024
+INPUT_MAX_CHARS = 2000       # Entradas longas (textos, transcrições) ficam só com o começo no histórico
+
+# Mesmos tipos/nomes que o frontend usa em TOOL_CONFIGS (utils/saveToHistory.js)
+TOOL_NAMES = {
+    'image-prompt': 'Gerador de Prompt de Imagem',
+    'veo3-prompt': 'Gerador de Prompt de Vídeo',
+    'text-summary': 'Resumidor de Textos',
+    'video-summary': 'Resumidor de Vídeos',
+    'abnt': 'Formatador ABNT',
+    'translation': 'Tradutor Corporativo',
+    'cover-letter': 'Gerador de Carta de Apresentação',
+    'social': 'Gerador de Social Media',
+    'essay': 'Corretor de Redação',
+    'interview': 'Simulador de Entrevista',
+    'study': 'Gerador de Material de Estudo',
+    'chat-pdf': 'Chat com PDF',
+}
+
+
+def encode_cursor(item):
+    raw = json.dumps([item['created_at'], item['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    # Devolve (created_at, id) ou levanta ValueError para cursor inválido
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(created_at), item_id
+    except Exception:
+        raise ValueError("Cursor inválido.")
+
+def page_limit(value):
+    try:
+        return max(1, min(int(value), PAGE_MAX))
+    except (TypeError, ValueError):
+        return PAGE_DEFAULT
+
+def apply_cursor(query, cursor):
+    # Itens estritamente depois do cursor na ordem (created_at desc, id desc)
+    if not cursor: return query
+    created_at, item_id = decode_cursor(cursor)
+    ts = json.dumps(created_at)   # Aspas: o timestamp tem ":" e "+" que o PostgREST trataria como sintaxe
+    return query.or_(f"created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{json.dumps(item_id)})")
+
+def build_page(rows, limit, max_bytes=PAGE_MAX_BYTES):
+    # rows veio com limit+1 itens para sabermos se há próxima página.
+    # A página também para quando passa de max_bytes (sempre com pelo menos um item).
+    items, size = [], 0
+    for row in rows[:limit]:
+        row_size = len(json.dumps(row, ensure_ascii=False, default=str).encode())
+        if items and size + row_size > max_bytes: break
+        items.append(row)
+        size += row_size
+    has_more = len(items) < len(rows)
+    return items, (encode_cursor(items[-1]) if has_more and items else None)
+
+def etag_for(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+def history_row(user_id, tool_type, input_data, output_data, metadata=None, tool_name=None):
+    if not isinstance(input_data, str): input_data = json.dumps(input_data, ensure_ascii=False)
+    if output_data is not None and not isinstance(output_data, str): output_data = json.dumps(output_data, ensure_ascii=False)
+    return {
+        "user_id": user_id,
+        "tool_type": tool_type,
+        "tool_name": tool_name or TOOL_NAMES.get(tool_type, 'Ferramenta Adapta'),
+        "input_data": input_data[:INPUT_MAX_CHARS],
+        "output_data": output_data,
+        "metadata": metadata or {}
+    }
@@ -0,0 +1,176 @@
+# --- GRAVAÇÃO DO HISTÓRICO EM LOTE (WRITE-BEHIND) ---
+# As rotas só colocam o item numa fila e respondem; uma thread por worker junta os itens
+# e faz um insert em lote no Supabase a cada HISTORY_BATCH_SIZE itens ou HISTORY_FLUSH_INTERVAL segundos.
+#
+# Nada se perde se o Supabase falhar ou a fila encher: o lote vai para um SQLite local (spool)
+# e é reenviado depois por qualquer worker. Ao desligar o worker a fila é esvaziada (close()).
+# Só falhas passageiras (rede, 5xx, 429) vão para o spool. Se o banco recusar o lote (ex.: uma linha
+# viola uma constraint), o lote é dividido ao meio até isolar as linhas ruins, que vão para history_dead.
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+import local_store
+
+BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', 100))
+FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 1.0))
+QUEUE_MAX = int(os.environ.get('HISTORY_QUEUE_MAX', 5000))
+ENQUEUE_TIMEOUT = 0.5        # Quanto a requisição espera por vaga na fila antes de ir para o spool
+RETRY_INTERVAL = 30          # Intervalo entre tentativas de reenviar o spool
+TRANSIENT_CODES = {408, 429, 500, 502, 503, 504}
+# Classes de SQLSTATE passageiras: conexão, deadlock/serialização, falta de recursos, consulta cancelada;
+# PGRST000-003: o PostgREST não conseguiu falar com o banco
+TRANSIENT_SQLSTATE = ('08', '40', '53', '57', 'PGRST00')
+STORE = 'historico'
+
+local_store.connect(STORE).execute(
+    "CREATE TABLE IF NOT EXISTS history_spool (id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL, created_at REAL NOT NULL)")
+local_store.connect(STORE).execute(
+    "CREATE TABLE IF NOT EXISTS history_dead (id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL, "
+    "error TEXT NOT NULL, created_at REAL NOT NULL)")
+
+_writers = []
+
+
+def is_transient(error):
+    # Erros do PostgREST têm .code (SQLSTATE ou PGRSTxxx; às vezes o status HTTP); sem código é rede/timeout.
+    # ValueError/TypeError/KeyError são da própria linha (ex.: não serializa) e não melhoram repetindo.
+    code = getattr(error, 'code', None)
+    if isinstance(code, int): return code in TRANSIENT_CODES
+    if isinstance(code, str) and code:
+        if code.isdigit() and len(code) == 3: return int(code) in TRANSIENT_CODES
+        return code.startswith(TRANSIENT_SQLSTATE)
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+class HistoryWriter:
+    def __init__(self, insert_rows, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue=QUEUE_MAX):
+        self._insert_rows = insert_rows        # Recebe uma lista de linhas e grava de uma vez
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = threading.Event()
+        self._next_retry = 0
+        self.inserted = self.spooled = self.failed_batches = self.dead = 0
+        _writers.append(self)
+
+    def _ensure_thread(self):
+        # A thread nasce no primeiro uso dentro do worker (threads não sobrevivem ao fork do gunicorn)
+        if self._pid == os.getpid() and self._thread.is_alive(): return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='historico', daemon=True)
+                self._thread.start()
+
+    def add(self, row):
+        # Não espera o banco. Fila cheia por mais de ENQUEUE_TIMEOUT: o item vai direto para o spool.
+        if self._closed.is_set():
+            self._spool([row])
+            return False
+        self._ensure_thread()
+        try:
+            self._queue.put(row, timeout=ENQUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            self._spool([row])
+            return False
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._closed.is_set():
+            batch = self._take_batch()
+            if batch: self._write(batch)
+            if time.monotonic() >= self._next_retry: self._replay_spool()
+
+    def _write(self, rows):
+        # Devolve False se algo foi para o spool (o banco está com problema: vale esperar para reenviar)
+        try:
+            self._insert_rows(rows)
+            self.inserted += len(rows)
+            return True
+        except Exception as e:
+            self.failed_batches += 1
+            if is_transient(e):
+                print(f"Aviso: falha ao gravar {len(rows)} itens do histórico, guardando no spool: {e}")
+                self._spool(rows)
+                self._next_retry = time.monotonic() + RETRY_INTERVAL
+                return False
+            if len(rows) == 1:
+                print(f"Aviso: item do histórico recusado pelo banco, guardado em history_dead: {e}")
+                self._dead_letter(rows[0], e)
+                return True
+            # Lote recusado: divide ao meio para gravar as linhas boas e isolar as ruins
+            half = len(rows) // 2
+            return self._write(rows[:half]) & self._write(rows[half:])
+
+    def _dead_letter(self, row, error):
+        local_store.connect(STORE).execute(
+            "INSERT INTO history_dead (row, error, created_at) VALUES (?, ?, ?)",
+            (json.dumps(row, ensure_ascii=False, default=str), str(error)[:1000], time.time()))
+        self.dead += 1
+
+    def _spool(self, rows):
+        now = time.time()
+        local_store.connect(STORE).executemany(
+            "INSERT INTO history_spool (row, created_at) VALUES (?, ?)",
+            [(json.dumps(row, ensure_ascii=False, default=str), now) for row in rows])
+        self.spooled += len(rows)
+
+    def _replay_spool(self):
+        # DELETE ... RETURNING "reserva" as linhas: dois workers nunca reenviam o mesmo item
+        self._next_retry = time.monotonic() + RETRY_INTERVAL
+        while True:
+            claimed = local_store.connect(STORE).execute(
+                "DELETE FROM history_spool WHERE id IN (SELECT id FROM history_spool ORDER BY id LIMIT ?) RETURNING row",
+                (self.batch_size,)).fetchall()
+            if not claimed: return
+            if not self._write([json.loads(row) for row, in claimed]): return
+
+    def close(self, timeout=10):
+        # Esvazia a fila antes do worker sair; o que não couber no prazo vai para o spool
+        if self._closed.is_set(): return
+        self._closed.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 1)
+        deadline = time.monotonic() + timeout
+        while True:
+            rows = []
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not rows: return
+            if time.monotonic() < deadline: self._write(rows)
+            else: self._spool(rows)
+
+    def stats(self):
+        conn = local_store.connect(STORE)
+        spool = conn.execute("SELECT COUNT(*) FROM history_spool").fetchone()[0]
+        dead = conn.execute("SELECT COUNT(*) FROM history_dead").fetchone()[0]
+        return {'queued': self._queue.qsize(), 'inserted': self.inserted, 'spooled': self.spooled,
+                'failed_batches': self.failed_batches, 'spool_pending': spool, 'dead_letter': self.dead,
+                'dead_letter_total': dead}
+
+
+def close_all():
+    for writer in _writers: writer.close()
+
+atexit.register(close_all)
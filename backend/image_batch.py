@@ -0,0 +1,82 @@
+# --- GERAÇÃO DE IMAGENS EM LOTE ---
+# Vários prompts numa requisição: prompts+parâmetros iguais viram uma prediction só,
+# as predictions rodam em paralelo e cada resultado é devolvido assim que fica pronto.
+# Os limites por usuário e global valem para a máquina toda (todos os workers do gunicorn):
+# são vagas travadas com flock, como o semáforo do admission.py.
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import admission
+import local_store
+from image_jobs import IMAGE_MODEL, image_input, replicate_client
+from image_store import materialize_safe
+
+MAX_BATCH_PROMPTS = int(os.environ.get('IMAGE_BATCH_MAX_PROMPTS', 20))
+MAX_VARIATIONS = 4                      # Limite do num_outputs do flux-schnell
+PER_USER_CONCURRENCY = int(os.environ.get('IMAGE_PER_USER_CONCURRENCY', 2))
+GLOBAL_CONCURRENCY = int(os.environ.get('IMAGE_GLOBAL_CONCURRENCY', 8))
+SLOT_WAIT = 0.2                         # Espera entre tentativas quando não há vaga livre
+SLOTS_DIR = os.path.join(local_store.STATE_DIR, 'vagas-imagem')
+
+_executor = ThreadPoolExecutor(max_workers=GLOBAL_CONCURRENCY, thread_name_prefix='imagem')
+
+
+def _acquire_slots(user_id):
+    # Uma vaga do usuário e uma global; devolve os dois arquivos travados ou None
+    user_dir = os.path.join(SLOTS_DIR, 'usuarios', hashlib.sha256(str(user_id).encode()).hexdigest()[:32])
+    user_fd = admission.acquire_slot(user_dir, PER_USER_CONCURRENCY)
+    if user_fd is None: return None
+    global_fd = admission.acquire_slot(os.path.join(SLOTS_DIR, 'global'), GLOBAL_CONCURRENCY)
+    if global_fd is None:
+        admission.release_slot(user_fd)
+        return None
+    return user_fd, global_fd
+
+def _release_slots(slots):
+    for fd in slots: admission.release_slot(fd)
+
+def plan_batch(prompts, variations=1, aspect_ratio='1:1'):
+    # Agrupa os índices originais por (prompt, parâmetros): cada grupo é uma prediction
+    variations = max(1, min(int(variations or 1), MAX_VARIATIONS))
+    groups = OrderedDict()
+    for i, prompt in enumerate(prompts):
+        key = (" ".join(str(prompt).split()), variations, aspect_ratio)
+        groups.setdefault(key, []).append(i)
+    return groups
+
+def _run_prediction(key):
+    prompt, variations, aspect_ratio = key
+    output = replicate_client.run(IMAGE_MODEL, input=image_input(prompt, num_outputs=variations, aspect_ratio=aspect_ratio))
+    urls = [str(item) for item in (output if isinstance(output, list) else list(output))]
+    return urls, [materialize_safe(url) for url in urls]
+
+def run_batch(user_id, groups):
+    # Gera um dict por prediction concluída, na ordem em que terminam.
+    # Até PER_USER_CONCURRENCY predictions do mesmo usuário (somando todas as requisições dele, em qualquer
+    # worker) e GLOBAL_CONCURRENCY no total ficam em voo. A vaga é solta quando a prediction termina,
+    # mesmo que o cliente tenha desconectado no meio.
+    pending = list(groups.items())
+    in_flight = {}
+    while pending or in_flight:
+        while pending:
+            slots = _acquire_slots(user_id)
+            if slots is None: break
+            key, indexes = pending.pop(0)
+            future = _executor.submit(_run_prediction, key)
+            future.add_done_callback(lambda _, slots=slots: _release_slots(slots))
+            in_flight[future] = (key, indexes)
+        if not in_flight:
+            time.sleep(SLOT_WAIT)
+            continue
+        done, _ = wait(list(in_flight), timeout=SLOT_WAIT if pending else 1, return_when=FIRST_COMPLETED)
+        for future in done:
+            key, indexes = in_flight.pop(future)
+            result = {'indexes': indexes, 'prompt': key[0]}
+            try:
+                result['image_urls'], result['image_ids'] = future.result()
+            except Exception as e:
+                result['error'] = str(e)
+            yield result
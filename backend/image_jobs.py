@@ -0,0 +1,132 @@
+# --- JOBS ASSÍNCRONOS DE IMAGEM (REPLICATE) ---
+# Em vez de segurar o worker até a imagem ficar pronta, criamos a prediction e devolvemos um job_id.
+# O status é atualizado pelo webhook do Replicate ou, na falta dele, consultando a API no polling.
+import base64
+import hashlib
+import hmac
+import os
+import time
+import uuid
+
+import replicate
+
+import local_store
+from image_store import image_urls, materialize_safe
+
+IMAGE_MODEL = "black-forest-labs/flux-schnell"
+TERMINAL_STATUSES = ('succeeded', 'failed', 'canceled')
+POLL_INTERVAL = 1.0           # Intervalo mínimo entre consultas ao Replicate por job
+STORE = 'imagens'
+
+# REPLICATE_API_BASE permite apontar para um Replicate falso nos testes de carga
+replicate_client = replicate.Client(
+    api_token=os.environ.get('REPLICATE_API_TOKEN'),
+    base_url=os.environ.get('REPLICATE_API_BASE') or None
+)
+webhook_url = os.environ.get('REPLICATE_WEBHOOK_URL')        # ex.: https://api.../replicate-webhook
+webhook_secret = os.environ.get('REPLICATE_WEBHOOK_SECRET')  # whsec_... (painel do Replicate)
+
+local_store.connect(STORE).execute(
+    "CREATE TABLE IF NOT EXISTS image_jobs (id TEXT PRIMARY KEY, prediction_id TEXT UNIQUE, user_id TEXT NOT NULL, "
+    "prompt TEXT NOT NULL, status TEXT NOT NULL, image_url TEXT, error TEXT, created_at REAL NOT NULL, "
+    "updated_at REAL NOT NULL, polled_at REAL NOT NULL DEFAULT 0, image_id TEXT)")
+try:
+    # Bancos criados antes do cache de imagens não têm a coluna image_id
+    local_store.connect(STORE).execute("ALTER TABLE image_jobs ADD COLUMN image_id TEXT")
+except Exception:
+    pass
+
+
+def image_input(prompt, **overrides):
+    params = {
+        "prompt": prompt,
+        "go_fast": True,
+        "megapixels": "1",
+        "num_outputs": 1,
+        "aspect_ratio": "1:1",
+        "output_format": "webp",
+        "output_quality": 80
+    }
+    params.update(overrides)
+    return params
+
+def first_output_url(output):
+    # O Replicate devolve uma lista, um iterador ou um texto direto
+    if output is None: return None
+    if isinstance(output, str): return output
+    if isinstance(output, list): return str(output[0]) if output else None
+    if hasattr(output, '__iter__'): return str(next(iter(output), None) or '') or None
+    return str(output)
+
+def _row_to_job(row):
+    if row is None: return None
+    keys = ('id', 'prediction_id', 'user_id', 'prompt', 'status', 'image_url', 'error', 'created_at', 'updated_at', 'polled_at', 'image_id')
+    return dict(zip(keys, row))
+
+def _load(where, value):
+    row = local_store.connect(STORE).execute(
+        f"SELECT id, prediction_id, user_id, prompt, status, image_url, error, created_at, updated_at, polled_at, image_id "
+        f"FROM image_jobs WHERE {where} = ?", (value,)).fetchone()
+    return _row_to_job(row)
+
+def _apply_prediction(job_id, status, output, error):
+    image_url = first_output_url(output) if status == 'succeeded' else None
+    # Guarda a imagem no cache local antes de marcar o job como pronto
+    image_id = materialize_safe(image_url) if image_url else None
+    now = time.time()
+    local_store.connect(STORE).execute(
+        "UPDATE image_jobs SET status = ?, image_url = COALESCE(?, image_url), image_id = COALESCE(?, image_id), "
+        "error = ?, updated_at = ?, polled_at = ? WHERE id = ?",
+        (status, image_url, image_id, str(error) if error else None, now, now, job_id))
+
+def submit(user_id, prompt, **overrides):
+    params = {}
+    # Sem a chave não há como validar o webhook (verify_webhook recusa): o job fica só no polling
+    if webhook_url and webhook_secret:
+        params = {'webhook': webhook_url, 'webhook_events_filter': ['completed']}
+    prediction = replicate_client.models.predictions.create(model=IMAGE_MODEL, input=image_input(prompt, **overrides), **params)
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    local_store.connect(STORE).execute(
+        "INSERT INTO image_jobs (id, prediction_id, user_id, prompt, status, created_at, updated_at, polled_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (job_id, prediction.id, user_id, prompt, prediction.status, now, now, now))
+    if prediction.status in TERMINAL_STATUSES:
+        _apply_prediction(job_id, prediction.status, prediction.output, prediction.error)
+    return _load('id', job_id)
+
+def get(job_id, user_id):
+    job = _load('id', job_id)
+    if not job or job['user_id'] != str(user_id): return None
+    # Sem webhook (ou se ele atrasar), consulta o Replicate no máximo 1x por segundo por job
+    if job['status'] not in TERMINAL_STATUSES and time.time() - job['polled_at'] >= POLL_INTERVAL:
+        prediction = replicate_client.predictions.get(job['prediction_id'])
+        _apply_prediction(job_id, prediction.status, prediction.output, prediction.error)
+        job = _load('id', job_id)
+    return job
+
+def verify_webhook(headers, body):
+    # Assinatura no padrão do Replicate: HMAC-SHA256 de "id.timestamp.corpo" com a chave whsec_.
+    # Sem REPLICATE_WEBHOOK_SECRET nada é aceito: qualquer um poderia marcar jobs como prontos.
+    if not webhook_secret: return False
+    msg_id = headers.get('webhook-id', '')
+    timestamp = headers.get('webhook-timestamp', '')
+    if not msg_id or not timestamp or abs(time.time() - int(timestamp)) > 300: return False
+    key = base64.b64decode(webhook_secret.split('_', 1)[-1])
+    expected = base64.b64encode(hmac.new(key, f"{msg_id}.{timestamp}.{body}".encode(), hashlib.sha256).digest()).decode()
+    signatures = [s.split(',', 1)[-1] for s in headers.get('webhook-signature', '').split()]
+    return any(hmac.compare_digest(expected, s) for s in signatures)
+
+def complete_from_webhook(payload):
+    job = _load('prediction_id', payload.get('id'))
+    if not job: return None
+    _apply_prediction(job['id'], payload.get('status'), payload.get('output'), payload.get('error'))
+    return _load('id', job['id'])
+
+def public_job(job, base_url):
+    result = {'job_id': job['id'], 'status': job['status']}
+    if job['image_url']: result['image_url'] = job['image_url']
+    if job['image_id']: result.update(image_urls(job['image_id'], base_url))
+    if job['error']: result['error'] = job['error']
+    return result
@@ -0,0 +1,106 @@
+# --- CACHE LOCAL DAS IMAGENS GERADAS ---
+# Os links do Replicate expiram. Baixamos cada imagem uma vez, guardamos pelo SHA-256 do conteúdo
+# e já deixamos prontas as versões menores para o histórico (miniatura e prévia).
+#
+#   <IMAGE_CACHE_DIR>/<2 primeiros>/<hash>/original.webp | preview.webp | thumb.webp
+#
+# Só baixa dos hosts de entrega do Replicate (IMAGE_ALLOWED_HOSTS, "*." vale para subdomínios):
+# a URL vem da resposta do Replicate ou do webhook, e o servidor não pode ser usado para buscar
+# endereços internos (SSRF).
+import hashlib
+import os
+import re
+import tempfile
+from urllib.parse import urlparse
+
+import requests
+from PIL import Image
+
+import local_store
+
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR') or os.path.join(local_store.STATE_DIR, 'imagens')
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+VARIANTS = {'preview': 768, 'thumb': 256}   # Lado maior em pixels
+ALL_VARIANTS = ('original',) + tuple(VARIANTS)
+ALLOWED_HOSTS = [h.strip().lower() for h in
+                 os.environ.get('IMAGE_ALLOWED_HOSTS', 'replicate.delivery,*.replicate.delivery').split(',') if h.strip()]
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')   # http só para o Replicate falso dos testes
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _dir_for(image_id):
+    return os.path.join(IMAGE_CACHE_DIR, image_id[:2], image_id)
+
+def path_for(image_id, variant):
+    if not _HASH_RE.match(image_id or '') or variant not in ALL_VARIANTS: return None
+    path = os.path.join(_dir_for(image_id), f"{variant}.webp")
+    return path if os.path.exists(path) else None
+
+def _atomic_write(path, write):
+    # Escreve num temporário e renomeia: outro worker nunca lê um arquivo pela metade
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            write(out)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def allowed_url(url):
+    parts = urlparse(url or '')
+    host = (parts.hostname or '').lower()
+    if parts.scheme != 'https' and not (parts.scheme == 'http' and host in LOCAL_HOSTS): return False
+    return any(host == h or (h.startswith('*.') and host.endswith(h[1:])) for h in ALLOWED_HOSTS)
+
+def materialize(url):
+    # Baixa a imagem, guarda pelo hash do conteúdo e gera as variantes. Devolve o image_id (hash).
+    if not allowed_url(url): raise ValueError(f"Host de imagem não permitido: {urlparse(url).hostname}")
+    digest = hashlib.sha256()
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    # Baixa dentro da pasta do cache para o os.replace final não cruzar sistemas de arquivos
+    fd, download = tempfile.mkstemp(dir=IMAGE_CACHE_DIR, suffix='.download')
+    try:
+        with os.fdopen(fd, 'wb') as out, requests.get(url, stream=True, timeout=30, allow_redirects=False) as resp:
+            resp.raise_for_status()
+            size = 0
+            for block in resp.iter_content(64 * 1024):
+                size += len(block)
+                if size > MAX_DOWNLOAD_BYTES: raise ValueError("Imagem grande demais para o cache.")
+                digest.update(block)
+                out.write(block)
+
+        image_id = digest.hexdigest()
+        folder = _dir_for(image_id)
+        if path_for(image_id, 'original'): return image_id    # Já materializada antes
+
+        os.makedirs(folder, exist_ok=True)
+        with Image.open(download) as img:
+            img.load()
+            for variant, side in VARIANTS.items():
+                small = img.copy()
+                small.thumbnail((side, side))
+                _atomic_write(os.path.join(folder, f"{variant}.webp"), lambda out: small.save(out, 'WEBP', quality=80))
+        # O original fica com os bytes exatos do Replicate (mesmo hash, sem recomprimir)
+        os.replace(download, os.path.join(folder, 'original.webp'))
+        return image_id
+    finally:
+        if os.path.exists(download): os.remove(download)
+
+def materialize_safe(url):
+    # Falha no cache não pode derrubar a geração: o link original continua valendo
+    try:
+        return materialize(url) if url else None
+    except Exception as e:
+        print(f"Aviso: não foi possível guardar a imagem no cache: {e}")
+        return None
+
+def image_urls(image_id, base_url):
+    base = base_url.rstrip('/')
+    return {
+        'image_id': image_id,
+        'cached_image_url': f"{base}/images/{image_id}/original",
+        'preview_url': f"{base}/images/{image_id}/preview",
+        'thumbnail_url': f"{base}/images/{image_id}/thumb"
+    }
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Relatório de boot: tempo de "import app" e memória residente do worker
+#   - sob demanda (padrão): nada pesado é importado no boot
+#   - WARMUP_TOOLS=all: tudo carregado no boot, como era antes do lazy_tools
+#   - cada ferramenta sozinha: quanto a primeira requisição dela paga (ou o boot, se for pré-carregada)
+#
+# Uso: python import_report.py [repetições]
+# Cada medida roda num processo novo (imports ficam em cache dentro do processo).
+REPETICOES = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+MEDIR = r'''
+import json, os, time
+inicio = time.perf_counter()
+import app
+boot = time.perf_counter() - inicio
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for linha in f:
+            if linha.startswith('VmRSS:'): return int(linha.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({'boot': boot, 'rss': rss_mb(), 'tools': app.lazy_tools.stats()}))
+'''
+
+
+def medir(warmup):
+    env = dict(os.environ, WARMUP_TOOLS=warmup, ADAPTA_STATE_DIR=tempfile.mkdtemp(prefix='adapta-import-'))
+    # Chaves falsas: nenhum cliente faz rede no boot, mas o Supabase só é registrado com URL e chave
+    env.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+    env.setdefault('SUPABASE_KEY', 'chave-falsa')
+    medidas = []
+    for _ in range(REPETICOES):
+        saida = subprocess.run([sys.executable, '-c', MEDIR], env=env, cwd=PASTA,
+                               capture_output=True, text=True, check=True).stdout
+        medidas.append(json.loads(saida.strip().splitlines()[-1]))
+    medidas.sort(key=lambda m: m['boot'])
+    return medidas[len(medidas) // 2]   # mediana pelo tempo de boot
+
+
+if __name__ == '__main__':
+    print(f"\n--- BOOT DO WORKER (mediana de {REPETICOES} processos) ---")
+    lazy = medir('')
+    eager = medir('all')
+    print(f"{'modo':>22} {'import app (s)':>15} {'RSS (MB)':>10}")
+    print(f"{'sob demanda':>22} {lazy['boot']:>15.3f} {lazy['rss']:>10.1f}")
+    print(f"{'WARMUP_TOOLS=all':>22} {eager['boot']:>15.3f} {eager['rss']:>10.1f}")
+    print(f"{'economia':>22} {eager['boot'] - lazy['boot']:>15.3f} {eager['rss'] - lazy['rss']:>10.1f}")
+
+    print(f"\n--- CUSTO DE CADA FERRAMENTA (primeiro uso) ---")
+    print(f"{'ferramenta':>22} {'carga (s)':>15} {'+RSS (MB)':>10}")
+    for nome in lazy['tools']:
+        m = medir(nome)
+        print(f"{nome:>22} {m['tools'][nome]['seconds']:>15.3f} {m['rss'] - lazy['rss']:>10.1f}")
+    print("-------------------------------------------------------------\n")
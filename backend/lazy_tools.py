@@ -0,0 +1,77 @@
+# --- BIBLIOTECAS PESADAS SOB DEMANDA ---
+# Gemini, Supabase, Stripe, Replicate, python-docx, pypdf, numpy, Pillow e pytube só são importados
+# quando a primeira rota que precisa deles roda. O worker sobe mais rápido e só carrega na memória
+# o que realmente usou. Quem quiser pagar o custo antes pode pré-carregar no boot:
+#
+#   WARMUP_TOOLS=gemini,supabase     (ou "all")
+#
+# O tempo de cada carga aparece no /metrics (adapta_tool_load_seconds e a etapa "import" da rota).
+# python import_report.py mede o boot e a memória com e sem o pré-carregamento.
+import importlib
+import threading
+import time
+
+import metrics
+
+_tools = {}   # nome da ferramenta -> lista de Lazy
+
+
+class Lazy:
+    # Objeto que chama loader() no primeiro acesso a um atributo e passa a se comportar como o resultado
+    def __init__(self, tool, loader):
+        self._tool = tool
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+        self.seconds = None
+
+    def load(self):
+        if self._loaded: return self._value
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                with metrics.stage('import'):
+                    self._value = self._loader()
+                self.seconds = time.perf_counter() - start
+                self._loaded = True
+                metrics.observe('tool_load_seconds', self.seconds, tool=self._tool)
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __bool__(self):
+        # "if not model" continua funcionando: carrega e testa o objeto de verdade
+        return bool(self.load())
+
+    def __repr__(self):
+        return f"<Lazy {self._tool} {'carregado' if self._loaded else 'pendente'}>"
+
+
+def tool(name, loader):
+    lazy = Lazy(name, loader)
+    _tools.setdefault(name, []).append(lazy)
+    return lazy
+
+def module(name, module_name):
+    return tool(name, lambda: importlib.import_module(module_name))
+
+def warmup(names):
+    # names: "gemini,supabase" ou "all"
+    names = [n.strip() for n in (names or '').split(',') if n.strip()]
+    if 'all' in names: names = list(_tools)
+    for name in names:
+        if name not in _tools:
+            print(f"Aviso: WARMUP_TOOLS tem uma ferramenta desconhecida: {name} (opções: {', '.join(sorted(_tools))})")
+            continue
+        for lazy in _tools[name]:
+            try:
+                lazy.load()
+            except Exception as e:
+                print(f"Aviso: falha ao pré-carregar {name}: {e}")
+
+def stats():
+    return {name: {'loaded': all(l._loaded for l in items),
+                   'seconds': round(sum(l.seconds or 0 for l in items), 4)}
+            for name, items in sorted(_tools.items())}
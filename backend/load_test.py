@@ -0,0 +1,309 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_upstreams import FakeUpstreams, load_profiles
+
+# Teste de carga e benchmark offline: sobe Gemini, Supabase, Replicate e Stripe falsos
+# (fake_upstreams.py, com latência e taxa de falhas configuráveis), roda o gunicorn com cada
+# perfil/número de workers e passa por todas as rotas do app.py medindo p50/p95/p99 e req/s.
+# O resultado vai para um JSON em LOAD_TEST_OUTPUT para comparar com rodadas anteriores.
+#
+# Uso: python load_test.py [sync gthread]
+#
+#   LOAD_TEST_REQUESTS=50        requisições por rota
+#   LOAD_TEST_CONCURRENCY=20     requisições simultâneas
+#   LOAD_TEST_WORKERS=1,2        processos do gunicorn (uma rodada para cada valor)
+#   LOAD_TEST_ROUTES=/summarize-text,/ask-document   só essas rotas
+#   LOAD_TEST_REPEAT_INPUTS=1    repete as entradas (mede cache e coalescência em vez do caminho frio)
+#   LOAD_TEST_BASELINE=arquivo.json   mostra a diferença para uma rodada anterior
+#   FAKE_GEMINI="median=1,p95=3,fail=0.01" (e FAKE_SUPABASE, FAKE_REPLICATE, FAKE_STRIPE)
+REQUISICOES = int(os.environ.get('LOAD_TEST_REQUESTS', 50))
+CONCORRENCIA = int(os.environ.get('LOAD_TEST_CONCURRENCY', 20))
+WORKERS = [w.strip() for w in os.environ.get('LOAD_TEST_WORKERS', '2').split(',') if w.strip()]
+ROTAS = [r.strip() for r in os.environ.get('LOAD_TEST_ROUTES', '').split(',') if r.strip()]
+REPETIR_ENTRADAS = os.environ.get('LOAD_TEST_REPEAT_INPUTS') == '1'
+SAIDA = os.environ.get('LOAD_TEST_OUTPUT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados_carga'))
+BASELINE = os.environ.get('LOAD_TEST_BASELINE')
+PORTA_APP = 5099
+USUARIO = 'carga'
+SEGREDO_WEBHOOK = 'whsec_carga'
+SEGREDO_REPLICATE = 'whsec_' + base64.b64encode(b'segredo-carga').decode()
+VIDEOS = 20   # Transcrições pré-carregadas no cache local (o YouTube não tem versão falsa)
+
+PERFIS = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '128'},
+}
+
+# Compatibilidade com a versão anterior do script: LOAD_TEST_LATENCY fixa a latência do Gemini
+if os.environ.get('LOAD_TEST_LATENCY') and not os.environ.get('FAKE_GEMINI'):
+    os.environ['FAKE_GEMINI'] = f"median={os.environ['LOAD_TEST_LATENCY']},p95={os.environ['LOAD_TEST_LATENCY']}"
+
+
+def pdf_minimo(texto):
+    # PDF de uma página com texto extraível, montado à mão para não depender de biblioteca de escrita
+    conteudo = f"BT /F1 12 Tf 72 720 Td ({texto}) Tj ET".encode('latin-1', 'replace')
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(conteudo)).encode() + b" >>\nstream\n" + conteudo + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    saida = bytearray(b"%PDF-1.4\n")
+    posicoes = []
+    for i, obj in enumerate(objetos, 1):
+        posicoes.append(len(saida))
+        saida += f"{i} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(saida)
+    saida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    saida += b"".join(f"{p:010d} 00000 n \n".encode() for p in posicoes)
+    saida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(saida)
+
+
+def multipart(campos, arquivo):
+    fronteira = uuid.uuid4().hex
+    partes = []
+    for nome, valor in campos.items():
+        partes.append(f'--{fronteira}\r\nContent-Disposition: form-data; name="{nome}"\r\n\r\n{valor}\r\n'.encode())
+    nome, nome_arquivo, dados = arquivo
+    partes.append(f'--{fronteira}\r\nContent-Disposition: form-data; name="{nome}"; filename="{nome_arquivo}"\r\n'
+                  f'Content-Type: application/pdf\r\n\r\n'.encode() + dados + b"\r\n")
+    partes.append(f"--{fronteira}--\r\n".encode())
+    return b"".join(partes), f"multipart/form-data; boundary={fronteira}"
+
+
+def assinar_stripe(payload):
+    ts = int(time.time())
+    assinatura = hmac.new(SEGREDO_WEBHOOK.encode(), f"{ts}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={ts},v1={assinatura}"
+
+def assinar_replicate(payload):
+    msg_id, ts = f"msg_{uuid.uuid4().hex[:8]}", str(int(time.time()))
+    chave = base64.b64decode(SEGREDO_REPLICATE.split('_', 1)[-1])
+    assinatura = base64.b64encode(hmac.new(chave, f"{msg_id}.{ts}.{payload}".encode(), hashlib.sha256).digest()).decode()
+    return {'webhook-id': msg_id, 'webhook-timestamp': ts, 'webhook-signature': f"v1,{assinatura}"}
+
+
+# --- Cenários: cada um monta a requisição i (método, caminho, corpo, cabeçalhos) ---
+def unico(i):
+    return 'fixo' if REPETIR_ENTRADAS else f"{i}-{uuid.uuid4().hex[:8]}"
+
+def post(caminho, corpo_fn):
+    return lambda i, estado: ('POST', caminho, json.dumps(corpo_fn(i, estado)).encode(), {'Content-Type': 'application/json'})
+
+def get(caminho_fn):
+    return lambda i, estado: ('GET', caminho_fn(i, estado), None, {})
+
+def upload(i, estado):
+    corpo, tipo = multipart({'user_id': USUARIO}, ('file', f'doc{i}.pdf', pdf_minimo(f"Documento de carga {unico(i)} " * 20)))
+    return 'POST', '/upload-document', corpo, {'Content-Type': tipo}
+
+def webhook_stripe(i, estado):
+    payload = json.dumps({'id': f'evt_{i}', 'object': 'event', 'type': 'checkout.session.completed',
+                          'data': {'object': {'id': f'cs_{i}', 'customer': 'cus_falso', 'metadata': {'user_id': USUARIO}}}})
+    return 'POST', '/webhook', payload.encode(), {'Content-Type': 'application/json', 'Stripe-Signature': assinar_stripe(payload)}
+
+def webhook_replicate(i, estado):
+    predicoes = estado.get('predicoes') or ['inexistente']
+    payload = json.dumps({'id': predicoes[i % len(predicoes)], 'status': 'succeeded', 'output': []})
+    return 'POST', '/replicate-webhook', payload.encode(), dict(assinar_replicate(payload), **{'Content-Type': 'application/json'})
+
+def guardar_job(resposta, estado):
+    if resposta.get('job_id'): estado.setdefault('jobs', []).append(resposta['job_id'])
+
+def guardar_imagem(resposta, estado):
+    if resposta.get('image_id'): estado.setdefault('imagens', []).append(resposta['image_id'])
+
+def de_estado(chave, padrao='0'):
+    return lambda i, estado: (estado.get(chave) or [padrao])[i % len(estado.get(chave) or [padrao])]
+
+CENARIOS = [
+    ('/health', get(lambda i, e: '/health'), None),
+    ('/generate-prompt', post('/generate-prompt', lambda i, e: {'user_id': USUARIO, 'idea': f'ideia {unico(i)}'}), None),
+    ('/generate-veo3-prompt', post('/generate-veo3-prompt', lambda i, e: {'user_id': USUARIO, 'idea': f'cena {unico(i)}'}), None),
+    ('/summarize-video', post('/summarize-video', lambda i, e: {'user_id': USUARIO, 'url': f'https://www.youtube.com/watch?v=carga{i % VIDEOS:06d}'}), None),
+    ('/format-abnt', post('/format-abnt', lambda i, e: {'user_id': USUARIO, 'text': f'Texto para formatar {unico(i)}'}), None),
+    ('/summarize-text', post('/summarize-text', lambda i, e: {'user_id': USUARIO, 'text': f'Texto longo para resumir {unico(i)} ' * 40}), None),
+    ('/summarize-text (stream)', post('/summarize-text', lambda i, e: {'user_id': USUARIO, 'stream': True, 'text': f'Outro texto para resumir {unico(i)} ' * 40}), None),
+    ('/download-docx', post('/download-docx', lambda i, e: {'markdown_text': f"# Título {i}\n\nParágrafo com **negrito**.\n\n- item\n- item\n\n| a | b |\n|---|---|\n| 1 | 2 |\n" * 5}), None),
+    ('/generate-spreadsheet', post('/generate-spreadsheet', lambda i, e: {'user_id': USUARIO, 'prompt': f'vendas {unico(i)}', 'rows': 50}), None),
+    ('/upload-document', upload, None),
+    ('/ask-document', post('/ask-document', lambda i, e: {'user_id': USUARIO, 'document_id': 1, 'question': f'Qual o tema {unico(i)}?'}), None),
+    ('/corporate-translator', post('/corporate-translator', lambda i, e: {'user_id': USUARIO, 'text': f'texto {unico(i)}'}), None),
+    ('/generate-social-media', post('/generate-social-media', lambda i, e: {'user_id': USUARIO, 'topic': f'tema {unico(i)}'}), None),
+    ('/correct-essay', post('/correct-essay', lambda i, e: {'user_id': USUARIO, 'theme': 'Educação', 'essay': f'Redação {unico(i)} ' * 30}), None),
+    ('/mock-interview', post('/mock-interview', lambda i, e: {'user_id': USUARIO, 'role': f'Analista {unico(i)}', 'company': 'Empresa'}), None),
+    ('/generate-study-material', post('/generate-study-material', lambda i, e: {'user_id': USUARIO, 'topic': f'Tema {unico(i)}', 'save_history': True}), None),
+    ('/generate-cover-letter', post('/generate-cover-letter', lambda i, e: {'user_id': USUARIO, 'job_description': f'Vaga {unico(i)}', 'user_resume': 'Experiência'}), None),
+    ('/generate-image', post('/generate-image', lambda i, e: {'user_id': USUARIO, 'prompt': f'um gato {unico(i)}'}), guardar_imagem),
+    ('/generate-image/jobs', post('/generate-image/jobs', lambda i, e: {'user_id': USUARIO, 'prompt': f'um cão {unico(i)}'}), guardar_job),
+    ('/generate-image/jobs/<id>', get(lambda i, e: f"/generate-image/jobs/{de_estado('jobs')(i, e)}?user_id={USUARIO}"), None),
+    ('/generate-image/batch', post('/generate-image/batch', lambda i, e: {'user_id': USUARIO, 'prompts': [f'paisagem {unico(i)} {n}' for n in range(3)]}), None),
+    ('/replicate-webhook', webhook_replicate, None),
+    ('/images/<id>/<variant>', get(lambda i, e: f"/images/{de_estado('imagens', '0' * 64)(i, e)}/thumb"), None),
+    ('/save-history', post('/save-history', lambda i, e: {'user_id': USUARIO, 'tool_type': 'study', 'input_data': f'tema {i}', 'output_data': 'saída'}), None),
+    ('/get-history', post('/get-history', lambda i, e: {'user_id': USUARIO, 'view': 'list', 'limit': 20}), None),
+    ('/history/<id>', get(lambda i, e: f"/history/{10 ** 6 - i % 20}?user_id={USUARIO}"), None),
+    ('/delete-history-item', post('/delete-history-item', lambda i, e: {'user_id': USUARIO, 'item_id': 10 ** 6 - i}), None),
+    ('/delete-history', post('/delete-history', lambda i, e: {'user_id': USUARIO, 'filter': {'tool_type': 'study'}}), None),
+    ('/create-checkout-session', post('/create-checkout-session', lambda i, e: {'user_id': USUARIO, 'email': 'carga@teste.com'}), None),
+    ('/create-portal-session', post('/create-portal-session', lambda i, e: {'user_id': USUARIO}), None),
+    ('/webhook', webhook_stripe, None),
+    ('/cache-stats', get(lambda i, e: '/cache-stats'), None),
+    ('/metrics', get(lambda i, e: '/metrics'), None),
+]
+
+
+def executar(cenario, i, estado):
+    nome, montar, depois = cenario
+    metodo, caminho, corpo, cabecalhos = montar(i, estado)
+    req = urllib.request.Request(f"http://127.0.0.1:{PORTA_APP}{caminho}", data=corpo, headers=cabecalhos, method=metodo)
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            dados = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        dados, status = e.read(), e.code
+    except Exception:
+        return time.perf_counter() - inicio, 0
+    tempo = time.perf_counter() - inicio
+    if depois and status < 300:
+        try:
+            depois(json.loads(dados), estado)
+        except ValueError:
+            pass
+    return tempo, status
+
+
+def percentil(tempos, q):
+    return tempos[min(len(tempos) - 1, int(q * len(tempos)))] if tempos else None
+
+
+def esperar_app(timeout=90):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{PORTA_APP}/health", timeout=1)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("O gunicorn não subiu a tempo.")
+
+
+def preparar_transcricoes(env):
+    # Grava transcrições falsas no cache local (mesma pasta de estado do gunicorn)
+    codigo = (
+        "import json\n"
+        "from youtube_transcripts import transcript_store, transcript_key\n"
+        f"for i in range({VIDEOS}):\n"
+        "    texto = ' '.join(['fala do vídeo de carga'] * 400)\n"
+        "    transcript_store.set(transcript_key(f'carga{i:06d}'), json.dumps({'lang': 'pt', 'text': texto}))\n"
+    )
+    subprocess.run([sys.executable, '-c', codigo], env=env, check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+
+
+def rodar_configuracao(perfil, workers, upstream):
+    env = dict(os.environ, **PERFIS[perfil])
+    env.update(upstream.env())
+    env.update({
+        'PORT': str(PORTA_APP),
+        'WEB_CONCURRENCY': workers,
+        'STRIPE_WEBHOOK_SECRET': SEGREDO_WEBHOOK,
+        'REPLICATE_WEBHOOK_SECRET': SEGREDO_REPLICATE,
+        'ADAPTA_STATE_DIR': tempfile.mkdtemp(prefix='adapta-carga-'),
+        'METRICS_FLUSH_INTERVAL': '1',
+    })
+    # Um único usuário faz todas as requisições: sem limite por usuário, a não ser que o teste peça
+    env.setdefault('ADMISSION_USER_LIMIT', '1000000:1000000')
+    env.setdefault('ADMISSION_ROUTE_LIMIT', '1000000:1000000')
+    env.setdefault('ADMISSION_ROUTE_LIMITS', '/generate-image=1000000:1000000,/generate-image/jobs=1000000:1000000,/generate-image/batch=1000000:1000000')
+    env.setdefault('IMAGE_PER_USER_CONCURRENCY', env.get('IMAGE_GLOBAL_CONCURRENCY', '8'))
+    preparar_transcricoes(env)
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'wsgi:app'], env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    resultado = {}
+    estado = {'predicoes': []}
+    try:
+        esperar_app()
+        for cenario in CENARIOS:
+            nome = cenario[0]
+            if ROTAS and nome not in ROTAS and nome.split(' ')[0] not in ROTAS: continue
+            if nome == '/replicate-webhook': estado['predicoes'] = estado.get('jobs', [])
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=CONCORRENCIA) as pool:
+                medidas = list(pool.map(lambda i: executar(cenario, i, estado), range(REQUISICOES)))
+            total = time.perf_counter() - inicio
+            tempos = sorted(t for t, _ in medidas)
+            status = {}
+            for _, s in medidas: status[str(s)] = status.get(str(s), 0) + 1
+            resultado[nome] = {
+                'req_s': round(REQUISICOES / total, 2),
+                'p50': round(percentil(tempos, 0.5), 4), 'p95': round(percentil(tempos, 0.95), 4),
+                'p99': round(percentil(tempos, 0.99), 4),
+                'falhas': sum(1 for _, s in medidas if not 200 <= s < 400), 'status': status,
+            }
+            r = resultado[nome]
+            print(f"{nome:>28} {r['req_s']:>8.1f} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f} {r['falhas']:>7}")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    return resultado
+
+
+def comparar(atual, anterior):
+    print(f"\n--- COMPARAÇÃO COM {BASELINE} (p95 e req/s) ---")
+    for config, rotas in atual.items():
+        base = anterior.get('resultados', {}).get(config)
+        if not base: continue
+        print(f"[{config}]")
+        for nome, r in rotas.items():
+            b = base.get(nome)
+            if not b: continue
+            dp95 = (r['p95'] / b['p95'] - 1) * 100 if b['p95'] else 0
+            dreq = (r['req_s'] / b['req_s'] - 1) * 100 if b['req_s'] else 0
+            print(f"{nome:>28}  p95 {b['p95']:.3f} -> {r['p95']:.3f} ({dp95:+.0f}%)  req/s {b['req_s']:.1f} -> {r['req_s']:.1f} ({dreq:+.0f}%)")
+
+
+if __name__ == '__main__':
+    perfis = sys.argv[1:] or list(PERFIS)
+    upstream = FakeUpstreams(profiles=load_profiles()).start()
+    print(f"\n--- TESTE DE CARGA: {REQUISICOES} requisições por rota, {CONCORRENCIA} simultâneas ---")
+    for nome, perfil in upstream.profiles.items(): print(f"  {nome:>9}: {perfil.as_dict()}")
+
+    resultados = {}
+    for perfil in perfis:
+        for workers in WORKERS:
+            config = f"{perfil}-{workers}w"
+            print(f"\n[{config}]")
+            print(f"{'rota':>28} {'req/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} {'falhas':>7}")
+            resultados[config] = rodar_configuracao(perfil, workers, upstream)
+
+    os.makedirs(SAIDA, exist_ok=True)
+    arquivo = os.path.join(SAIDA, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(arquivo, 'w') as f:
+        json.dump({
+            'data': time.strftime('%Y-%m-%dT%H:%M:%S'), 'requisicoes': REQUISICOES, 'concorrencia': CONCORRENCIA,
+            'repetir_entradas': REPETIR_ENTRADAS, 'servicos_falsos': {n: p.as_dict() for n, p in upstream.profiles.items()},
+            'chamadas_upstream': upstream.counts, 'resultados': resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados salvos em {arquivo}")
+
+    if BASELINE:
+        with open(BASELINE) as f: comparar(resultados, json.load(f))
+    print("-------------------------------------------------------------\n")
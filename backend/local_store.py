@@ -0,0 +1,25 @@
+# --- ARMAZENAMENTO LOCAL COMPARTILHADO ---
+# Arquivos SQLite numa pasta da máquina: todos os workers do gunicorn enxergam os mesmos dados
+# e eles sobrevivem a reinícios dos workers.
+import os
+import sqlite3
+import tempfile
+import threading
+
+STATE_DIR = os.environ.get('ADAPTA_STATE_DIR') or os.path.join(tempfile.gettempdir(), 'adapta-ia')
+
+_local = threading.local()
+
+def connect(name):
+    # Uma conexão por thread e por banco (sqlite3 não deve ser compartilhado entre threads)
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(name)
+    if conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(STATE_DIR, f"{name}.sqlite3"), timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conns[name] = conn
+    return conn
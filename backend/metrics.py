@@ -0,0 +1,283 @@
+# --- MÉTRICAS (LATÊNCIA POR ROTA E POR ETAPA) ---
+# Cada worker soma contadores e histogramas em memória (um dict e um lock, sem I/O na requisição).
+# Uma thread grava um retrato do worker no SQLite local a cada FLUSH_INTERVAL segundos;
+# /metrics junta os retratos de todos os workers do gunicorn e expõe no formato do Prometheus.
+#
+#   adapta_request_seconds{route}            tempo total da requisição
+#   adapta_stage_seconds{route, stage}       json, credits, model, embeddings, retrieval, render, other...
+#   adapta_requests_total{route, status}
+#   adapta_upstream_errors_total{service, stage}
+#   adapta_in_flight{route} / adapta_upstream_in_flight{service}
+#   adapta_cache_events_total{cache, event} e adapta_cache_hit_ratio{cache}
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+import local_store
+
+PREFIX = 'adapta_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+RETENTION = 24 * 3600         # Retratos de workers que já morreram ficam 1 dia
+STORE = 'metricas'
+CACHE_EVENTS = ('hits', 'memory_hits', 'disk_hits', 'misses', 'sets', 'errors')
+HELP = {
+    'request_seconds': 'Tempo total da requisição por rota.',
+    'stage_seconds': 'Tempo por etapa dentro da rota.',
+    'requests_total': 'Requisições por rota e status HTTP.',
+    'upstream_errors_total': 'Erros de serviços externos (Gemini, Supabase, Replicate, Stripe).',
+    'in_flight': 'Requisições em andamento por rota.',
+    'upstream_in_flight': 'Chamadas em andamento por serviço externo.',
+    'cache_events_total': 'Acertos, faltas e gravações dos caches.',
+    'cache_hit_ratio': 'Acertos / consultas de cada cache (todos os workers).',
+    'admission_rejected_total': 'Requisições recusadas antes da rota (route_rate, user_rate, overloaded).',
+    'admission_slots_in_use': 'Vagas do semáforo global ocupadas (chamadas ao modelo e ao Replicate).',
+    'tool_load_seconds': 'Tempo para carregar cada biblioteca pesada (lazy_tools).',
+    'gemini_calls_total': 'Tentativas de chamada ao Gemini por modelo e resultado (ok, timeout, retryable_error, error, rejected).',
+    'gemini_retries_total': 'Novas tentativas depois de erro passageiro.',
+    'gemini_hedges_total': 'Chamadas duplicadas depois do p95 (sent, won, lost).',
+    'gemini_fallbacks_total': 'Chamadas desviadas para o modelo reserva e o motivo.',
+    'gemini_breaker_transitions_total': 'Aberturas e fechamentos do circuit breaker por modelo.',
+}
+
+local_store.connect(STORE).execute(
+    "CREATE TABLE IF NOT EXISTS snapshots (id TEXT PRIMARY KEY, pid INTEGER NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)")
+
+_lock = threading.Lock()
+_counters = {}      # (nome, labels) -> valor
+_gauges = {}
+_histograms = {}    # (nome, labels) -> [contagem por bucket..., +Inf, soma]
+_collectors = {}    # nome do cache -> função que devolve os contadores dele
+_state = {'pid': None, 'thread': None, 'started': time.time()}
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def gauge_add(name, delta, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    i = 0
+    while i < len(BUCKETS) and seconds > BUCKETS[i]: i += 1
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None: hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        hist[i] += 1
+        hist[-1] += seconds
+    _ensure_thread()
+
+def register_cache(name, stats):
+    # stats() devolve contadores acumulados do processo (ex.: ResponseCache.stats)
+    _collectors[name] = stats
+
+def current_route():
+    if has_request_context() and request.url_rule is not None: return request.url_rule.rule
+    return 'background'
+
+@contextmanager
+def upstream(service, stage_name=None):
+    # Chamadas em andamento e erros de um serviço externo (sem medir tempo)
+    gauge_add('upstream_in_flight', 1, service=service)
+    try:
+        yield
+    except Exception:
+        inc('upstream_errors_total', service=service, stage=stage_name or service)
+        raise
+    finally:
+        gauge_add('upstream_in_flight', -1, service=service)
+
+@contextmanager
+def stage(name, service=None, route=None):
+    # Mede uma etapa da rota atual. Com service, também conta erros e chamadas em andamento daquele serviço.
+    route = route or current_route()
+    start = time.perf_counter()
+    try:
+        if service:
+            with upstream(service, name): yield
+        else:
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('stage_seconds', elapsed, route=route, stage=name)
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_stages = g.get('metrics_stages', 0.0) + elapsed
+
+def init_app(app):
+    @app.before_request
+    def _start():
+        g.metrics_start = time.perf_counter()
+        g.metrics_route = current_route()
+        gauge_add('in_flight', 1, route=g.metrics_route)
+        # Lê o JSON aqui para medir o parse; o Flask guarda o resultado e as rotas reaproveitam
+        if request.method == 'POST' and request.mimetype != 'multipart/form-data':
+            with stage('json'):
+                request.get_json(force=True, silent=True)
+
+    @app.after_request
+    def _finish_on_close(response):
+        # Fecha a medição quando a resposta termina de sair (em streaming, depois do último pedaço)
+        if 'metrics_start' not in g: return response
+        ctx_g = g._get_current_object()
+        route, status = g.metrics_route, response.status_code
+        def finish():
+            elapsed = time.perf_counter() - ctx_g.metrics_start
+            gauge_add('in_flight', -1, route=route)
+            inc('requests_total', route=route, status=status)
+            observe('request_seconds', elapsed, route=route)
+            observe('stage_seconds', max(elapsed - ctx_g.get('metrics_stages', 0.0), 0.0), route=route, stage='other')
+        response.call_on_close(finish)
+        return response
+
+# --- Retratos por worker (SQLite) ---
+def _snapshot():
+    with _lock:
+        data = {
+            'counters': [[n, list(l), v] for (n, l), v in _counters.items()],
+            'gauges': [[n, list(l), v] for (n, l), v in _gauges.items()],
+            'histograms': [[n, list(l), h] for (n, l), h in _histograms.items()],
+        }
+    for cache, stats in list(_collectors.items()):
+        try:
+            for event, value in stats().items():
+                if event in CACHE_EVENTS:
+                    data['counters'].append(['cache_events_total', [['cache', cache], ['event', event]], value])
+        except Exception:
+            pass
+    return data
+
+def flush():
+    pid = os.getpid()
+    now = time.time()
+    conn = local_store.connect(STORE)
+    conn.execute("INSERT OR REPLACE INTO snapshots (id, pid, updated_at, data) VALUES (?, ?, ?, ?)",
+                 (f"{pid}-{int(_state['started'])}", pid, now, json.dumps(_snapshot())))
+
+def _run():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Aviso: falha ao gravar métricas: {e}")
+
+def _ensure_thread():
+    # Uma thread por worker, criada no primeiro uso (threads não sobrevivem ao fork)
+    if _state['pid'] == os.getpid(): return
+    with _lock:
+        if _state['pid'] == os.getpid(): return
+        _state['pid'] = os.getpid()
+        _state['started'] = time.time()
+        _state['thread'] = threading.Thread(target=_run, name='metricas', daemon=True)
+        _state['thread'].start()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+def collect():
+    # Soma os retratos de todos os workers. Medidores (em andamento) só contam workers vivos.
+    flush()
+    conn = local_store.connect(STORE)
+    conn.execute("DELETE FROM snapshots WHERE updated_at < ?", (time.time() - RETENTION,))
+    counters, gauges, histograms = {}, {}, {}
+    for pid, data in conn.execute("SELECT pid, data FROM snapshots").fetchall():
+        data = json.loads(data)
+        alive = _alive(pid)
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        if alive:
+            for name, labels, value in data['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+        for name, labels, hist in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(hist))
+            for i, v in enumerate(hist): merged[i] += v
+
+    # Taxa de acerto por cache a partir dos contadores somados
+    by_cache = {}
+    for (name, labels), value in counters.items():
+        if name != 'cache_events_total': continue
+        labels = dict(labels)
+        by_cache.setdefault(labels['cache'], {})[labels['event']] = value
+    for cache, events in by_cache.items():
+        hits = events.get('hits', 0) + events.get('memory_hits', 0) + events.get('disk_hits', 0)
+        lookups = hits + events.get('misses', 0)
+        if lookups: gauges[('cache_hit_ratio', (('cache', cache),))] = round(hits / lookups, 4)
+    return counters, gauges, histograms
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+def render_prometheus():
+    counters, gauges, histograms = collect()
+    lines = []
+    def header(name, kind):
+        lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for kind, series in (('counter', counters), ('gauge', gauges)):
+        for name in sorted({n for n, _ in series}):
+            header(name, kind)
+            for (n, labels), value in sorted(series.items()):
+                if n == name: lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for name in sorted({n for n, _ in histograms}):
+        header(name, 'histogram')
+        for (n, labels), hist in sorted(histograms.items()):
+            if n != name: continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), hist[:-1]):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {round(hist[-1], 6)}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def _quantile(hist, q):
+    # Estimativa pelo limite superior do bucket (mesma ideia do histogram_quantile do Prometheus, sem interpolar)
+    total = sum(hist[:-1])
+    if not total: return None
+    target, seen = q * total, 0
+    for bound, count in zip(BUCKETS + (float('inf'),), hist[:-1]):
+        seen += count
+        if seen >= target: return bound
+    return None
+
+def summary():
+    # Versão JSON para leitura rápida: contagem, média e p50/p95/p99 por rota e etapa
+    counters, gauges, histograms = collect()
+    result = {'histograms': {}, 'counters': {}, 'gauges': {}}
+    for (name, labels), hist in sorted(histograms.items()):
+        count = sum(hist[:-1])
+        result['histograms'].setdefault(name, []).append({
+            **dict(labels), 'count': count, 'avg': round(hist[-1] / count, 4) if count else None,
+            'p50': _quantile(hist, 0.5), 'p95': _quantile(hist, 0.95), 'p99': _quantile(hist, 0.99)})
+    for target, series in (('counters', counters), ('gauges', gauges)):
+        for (name, labels), value in sorted(series.items()):
+            result[target].setdefault(name, []).append({**dict(labels), 'value': value})
+    return result
+
+atexit.register(lambda: _state['pid'] == os.getpid() and flush())
@@ -0,0 +1,128 @@
+# --- EXTRAÇÃO DE TEXTO DE PDF EM PARALELO ---
+# As páginas são extraídas em lotes num pool de processos (o pypdf é CPU puro e segura o GIL).
+# O pool usa "forkserver" porque o worker do gunicorn tem várias threads e fork direto não é seguro.
+#
+# Tempo limite por página (PDF_PAGE_TIMEOUT): dentro do processo do pool um SIGALRM interrompe a
+# página que demora demais; ela sai vazia e as outras páginas do lote são aproveitadas. Se um processo
+# não responder nem ao alarme (preso em código C), o pai mata os processos do pool e refaz os lotes pendentes.
+import atexit
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader
+
+MAX_PDF_PAGES = int(os.environ.get('MAX_PDF_PAGES', 500))
+PAGE_TIMEOUT = float(os.environ.get('PDF_PAGE_TIMEOUT', 10))
+PAGES_PER_TASK = 8
+POOL_WORKERS = int(os.environ.get('PDF_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+BATCH_MARGIN = 5          # Folga do pai sobre o tempo máximo de um lote antes de matar o pool
+MAX_POOL_RESTARTS = 2     # Por PDF: pool quebrado (processo morto) é refeito no máximo isso
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context('forkserver' if os.name == 'posix' else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=ctx)
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+def _reset_pool(pool=None, kill=False):
+    # Descarta o pool (só se ainda for o atual). kill=True termina os processos: shutdown() sozinho
+    # não para um processo ocupado, e ele continuaria gastando CPU com o PDF travado.
+    global _pool
+    with _pool_lock:
+        if _pool is None or (pool is not None and _pool is not pool): return
+        if kill:
+            for process in list((_pool._processes or {}).values()): process.terminate()
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# --- Dentro do processo do pool ---
+class _PageTimeout(BaseException):
+    # BaseException: o pypdf engole Exception em vários pontos e o alarme se perderia
+    pass
+
+def _on_alarm(signum, frame):
+    raise _PageTimeout()
+
+def _with_timeout(fn):
+    if not hasattr(signal, 'setitimer'): return fn()
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, PAGE_TIMEOUT)
+    try:
+        return fn()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _extract_range(path, start, end):
+    # None marca página que passou do tempo (o pai só avisa; para o documento ela sai vazia)
+    try:
+        reader = _with_timeout(lambda: PdfReader(path))
+    except _PageTimeout:
+        return [None] * (end - start)
+    texts = []
+    for i in range(start, end):
+        try:
+            texts.append(_with_timeout(lambda: reader.pages[i].extract_text()) or "")
+        except _PageTimeout:
+            texts.append(None)
+        except Exception:
+            texts.append("")
+    return texts
+
+def count_pages(path):
+    return len(PdfReader(path).pages)
+
+def iter_page_texts(path, total_pages=None):
+    # Gera o texto de cada página na ordem, já com o limite de páginas aplicado
+    total = min(total_pages if total_pages is not None else count_pages(path), MAX_PDF_PAGES)
+    ranges = [(start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK)]
+    pool = _get_pool()
+    futures = [pool.submit(_extract_range, path, start, end) for start, end in ranges]
+    restarts = 0
+    # Um lote começa no máximo quando o anterior termina (os lotes saem da fila em ordem):
+    # o prazo do pai conta a partir daí, e não do submit
+    ready_at = time.monotonic()
+
+    i = 0
+    while i < len(ranges):
+        start, end = ranges[i]
+        budget = PAGE_TIMEOUT * (end - start + 1) + BATCH_MARGIN
+        stuck = False
+        try:
+            texts = futures[i].result(timeout=max(ready_at + budget - time.monotonic(), 0))
+        except (FutureTimeout, BrokenProcessPool) as e:
+            stuck = isinstance(e, FutureTimeout)
+            _reset_pool(pool, kill=stuck)
+            if stuck:
+                print(f"Aviso: páginas {start + 1}-{end} do PDF travaram o processo de extração e foram ignoradas.")
+                texts = [None] * (end - start)
+            else:
+                if restarts >= MAX_POOL_RESTARTS: raise
+                restarts += 1
+            # Pool novo para os lotes que ainda não terminaram (os já prontos continuam valendo)
+            pool = _get_pool()
+            for j in range(i if not stuck else i + 1, len(ranges)):
+                done = futures[j].done() and not futures[j].cancelled() and futures[j].exception() is None
+                if not done: futures[j] = pool.submit(_extract_range, path, *ranges[j])
+            ready_at = time.monotonic()
+            if not stuck: continue
+        ready_at = time.monotonic()
+
+        skipped = sum(1 for text in texts if text is None)
+        if skipped and not stuck: print(f"Aviso: {skipped} página(s) entre {start + 1} e {end} do PDF passaram do tempo limite e foram ignoradas.")
+        for text in texts:
+            yield text or ""
+        i += 1
@@ -0,0 +1,84 @@
+# --- CACHE DE PERFIS (credits, is_pro, stripe_customer_id) ---
+# Cada worker guarda os perfis em memória por alguns segundos.
+# Quando o webhook do Stripe muda um perfil, a invalidação vai para um log SQLite local
+# que todos os workers do gunicorn leem (no máximo a cada SYNC_INTERVAL segundos).
+import threading
+import time
+from collections import OrderedDict
+
+import local_store
+
+PROFILE_FIELDS = ('credits', 'is_pro', 'stripe_customer_id')
+
+
+class ProfileCache:
+    SYNC_INTERVAL = 1.0
+    LOG_RETENTION = 3600
+    PRUNE_INTERVAL = 60           # Apaga o log antigo no máximo uma vez por minuto por worker
+
+    def __init__(self, ttl=60, max_entries=10000, store_name='perfis'):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store_name = store_name
+        self._items = OrderedDict()   # user_id -> (expira_em, perfil)
+        self._lock = threading.Lock()
+        self._next_sync = 0.0
+        self._next_prune = 0.0
+
+        conn = local_store.connect(store_name)
+        conn.execute("CREATE TABLE IF NOT EXISTS invalidations (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "user_id TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+
+    def get(self, user_id):
+        self._sync()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None: return None
+            if item[0] < time.time():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return dict(item[1])
+
+    def update(self, user_id, **fields):
+        # Mescla com o que já está em cache (ex.: o RPC de créditos não devolve o stripe_customer_id)
+        fields = {k: v for k, v in fields.items() if k in PROFILE_FIELDS}
+        with self._lock:
+            item = self._items.pop(user_id, None)
+            profile = dict(item[1]) if item and item[0] >= time.time() else {}
+            profile.update(fields)
+            self._items[user_id] = (time.time() + self.ttl, profile)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+        try:
+            local_store.connect(self.store_name).execute(
+                "INSERT INTO invalidations (user_id, created_at) VALUES (?, ?)", (str(user_id), time.time()))
+        except Exception as e:
+            print(f"Aviso: falha ao propagar invalidação de perfil: {e}")
+
+    def _sync(self):
+        now = time.time()
+        if now < self._next_sync: return
+        self._next_sync = now + self.SYNC_INTERVAL
+        try:
+            conn = local_store.connect(self.store_name)
+            rows = conn.execute("SELECT seq, user_id FROM invalidations WHERE seq > ? ORDER BY seq",
+                                (self._last_seq,)).fetchall()
+            if rows:
+                with self._lock:
+                    for _, user_id in rows:
+                        self._items.pop(user_id, None)
+                self._last_seq = rows[-1][0]
+            if now >= self._next_prune:
+                self._next_prune = now + self.PRUNE_INTERVAL
+                conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - self.LOG_RETENTION,))
+        except Exception as e:
+            print(f"Aviso: falha ao ler invalidações de perfil: {e}")
+
+    def __len__(self):
+        return len(self._items)
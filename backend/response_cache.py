@@ -0,0 +1,180 @@
+# --- CACHE DE RESPOSTAS DO GEMINI ---
+# Camada 1: LRU em memória por worker (com TTL e limite em bytes).
+# Camada 2: SQLite local compartilhado entre os workers e persistente entre reinícios.
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import local_store
+
+
+def normalize_prompt(prompt):
+    # Espaços e indentação dos f-strings não mudam a resposta, então não entram na chave
+    return " ".join(prompt.split())
+
+def make_key(route, model_name, prompt, config=None):
+    raw = json.dumps([route, model_name, normalize_prompt(prompt), config or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self._items = OrderedDict()   # key -> (expira_em, tamanho, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None: return None
+            if item[0] < time.time():
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return item[2]
+
+    def expires_at(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            return item[0] if item is not None and item[0] >= time.time() else None
+
+    def set(self, key, value, size, ttl=None):
+        if size > self.max_bytes: return
+        with self._lock:
+            self._remove(key)
+            self._items[key] = (time.time() + (ttl or self.ttl), size, value)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        item = self._items.pop(key, None)
+        if item is not None: self.total_bytes -= item[1]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteCache:
+    PRUNE_EVERY = 100
+
+    def __init__(self, name, max_bytes, ttl):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._writes = 0
+        local_store.connect(name).execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        local_store.connect(name).execute("CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed_at)")
+
+    def get(self, key):
+        # Devolve (valor, expira_em) ou None
+        conn = local_store.connect(self.name)
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        now = time.time()
+        if row[1] < now:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row
+
+    def set(self, key, value, ttl=None):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes: return
+        now = time.time()
+        conn = local_store.connect(self.name)
+        conn.execute("INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                     (key, value, size, now + (ttl or self.ttl), now))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0: self.prune()
+
+    def delete(self, key):
+        local_store.connect(self.name).execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def prune(self):
+        conn = local_store.connect(self.name)
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes: return
+        # Remove os menos acessados até ficar 10% abaixo do limite
+        excess = total - int(self.max_bytes * 0.9)
+        removed = 0
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+            if removed >= excess: break
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            removed += size
+
+
+class ResponseCache:
+    def __init__(self, name, memory_bytes, disk_bytes, ttl):
+        self.memory = LRUCache(memory_bytes, ttl)
+        self.disk = SQLiteCache(name, disk_bytes, ttl)
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+        try:
+            row = self.disk.get(key)
+        except Exception as e:
+            print(f"Aviso: falha ao ler o cache em disco: {e}")
+            self._count('errors')
+            row = None
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('disk_hits')
+        value, expires_at = row
+        # Sobe para a memória só pelo tempo que falta (ex.: resposta do modelo reserva, gravada com TTL curto)
+        self.memory.set(key, value, len(value.encode('utf-8')), max(expires_at - time.time(), 1))
+        return value
+
+    def remaining_ttl(self, key):
+        # Segundos até a entrada expirar (memória ou disco); None se não está no cache
+        expires_at = self.memory.expires_at(key)
+        if expires_at is None:
+            try:
+                row = self.disk.get(key)
+            except Exception:
+                row = None
+            expires_at = row[1] if row else None
+        return max(expires_at - time.time(), 1) if expires_at else None
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, len(value.encode('utf-8')), ttl)
+        try:
+            self.disk.set(key, value, ttl)
+        except Exception as e:
+            print(f"Aviso: falha ao gravar o cache em disco: {e}")
+            self._count('errors')
+        self._count('sets')
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['memory_bytes'] = self.memory.total_bytes
+        return stats
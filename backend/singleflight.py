@@ -0,0 +1,116 @@
+# --- COALESCÊNCIA DE CHAMADAS IGUAIS AO MODELO (SINGLE-FLIGHT) ---
+# Quando várias requisições pedem a mesma coisa ao mesmo tempo (mesma chave do cache de respostas),
+# só a primeira chama o Gemini; as outras esperam essa chamada e recebem o mesmo texto.
+# Vale para respostas normais e em streaming: quem chega depois recebe os pedaços já gerados
+# e acompanha o resto em tempo real. A coalescência é por processo (cada worker do gunicorn).
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+
+    def publish(self, piece):
+        with self.cond:
+            self.pieces.append(piece)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def follow(self):
+        # Gera os pedaços na ordem, esperando pelos que ainda não chegaram
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.pieces) and not self.done:
+                    self.cond.wait()
+                if i < len(self.pieces):
+                    piece = self.pieces[i]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            i += 1
+            yield piece
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _join(self, key):
+        # Devolve (call, é_líder)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.followers += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def _leave(self, key, call, error=None):
+        with self._lock:
+            if self._calls.get(key) is call: del self._calls[key]
+        call.finish(error)
+
+    def do(self, key, fn):
+        call, leader = self._join(key)
+        if not leader: return "".join(call.follow())
+        try:
+            result = fn()
+        except Exception as e:
+            self._leave(key, call, e)
+            raise
+        call.publish(result)
+        self._leave(key, call)
+        return result
+
+    def stream(self, key, fn):
+        # fn() devolve um iterador de pedaços de texto
+        call, leader = self._join(key)
+        if not leader:
+            yield from call.follow()
+            return
+
+        pieces = fn()
+        try:
+            for piece in pieces:
+                call.publish(piece)
+                yield piece
+        except GeneratorExit:
+            # O cliente do líder desconectou: se alguém está esperando, termina de ler o modelo numa thread
+            with self._lock:
+                keep = call.waiters > 0
+                if not keep and self._calls.get(key) is call: del self._calls[key]
+            if keep: threading.Thread(target=self._drain, args=(key, call, pieces), daemon=True).start()
+            else: call.finish(RuntimeError("Chamada ao modelo interrompida."))
+            raise
+        except Exception as e:
+            self._leave(key, call, e)
+            raise
+        self._leave(key, call)
+
+    def _drain(self, key, call, pieces):
+        try:
+            for piece in pieces: call.publish(piece)
+            self._leave(key, call)
+        except Exception as e:
+            self._leave(key, call, e)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'in_flight': in_flight, 'leaders': self.leaders, 'followers': self.followers}
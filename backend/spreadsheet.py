@@ -0,0 +1,82 @@
+# --- MOTOR DE PLANILHAS (SEM PANDAS) ---
+# Lê o array JSON do modelo enquanto ele chega e escreve linha a linha:
+# XLSX no modo constant_memory do xlsxwriter (uma linha por vez na memória) ou CSV direto na resposta.
+import csv
+import io
+import json
+
+import lazy_tools
+
+xlsxwriter = lazy_tools.module('xlsx', 'xlsxwriter')
+
+SHEET_NAME = 'Relatório IA'
+COLUMN_WIDTH = 20
+HEADER_FORMAT = {'bold': True, 'fg_color': '#1e3a8a', 'font_color': 'white', 'border': 1}
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(pieces):
+    # Devolve cada objeto do primeiro array JSON assim que ele fecha no texto recebido.
+    # Ignora o que vier antes do "[" (ex.: ```json) e para no "]" final.
+    buffer = ""
+    started = False
+    for piece in pieces:
+        buffer += piece
+        if not started:
+            start = buffer.find('[')
+            if start == -1: continue
+            buffer = buffer[start + 1:]
+            started = True
+        while True:
+            stripped = buffer.lstrip().lstrip(',').lstrip()
+            if stripped.startswith(']'): return
+            if not stripped:
+                buffer = ""
+                break
+            try:
+                obj, end = _decoder.raw_decode(stripped)
+            except ValueError:
+                # Objeto ainda incompleto: espera o próximo pedaço
+                buffer = stripped
+                break
+            buffer = stripped[end:]
+            if isinstance(obj, dict): yield obj
+
+def _cell(value):
+    if value is None or isinstance(value, (str, int, float, bool)): return value
+    return json.dumps(value, ensure_ascii=False)
+
+def write_xlsx(rows, path):
+    # rows é um iterador de dicts; as colunas vêm da primeira linha
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(SHEET_NAME)
+    header_fmt = workbook.add_format(HEADER_FORMAT)
+    columns = None
+    count = 0
+    for row in rows:
+        if columns is None:
+            columns = list(row.keys())
+            for i, col in enumerate(columns):
+                worksheet.set_column(i, i, COLUMN_WIDTH)
+                worksheet.write(0, i, col, header_fmt)
+        count += 1
+        for i, col in enumerate(columns):
+            worksheet.write(count, i, _cell(row.get(col)))
+    workbook.close()
+    return count
+
+def iter_csv(rows):
+    # Gera o CSV em pedaços (uma linha por vez) para mandar direto na resposta
+    out = io.StringIO()
+    writer = csv.writer(out)
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = list(row.keys())
+            out.write('\ufeff')   # BOM: o Excel abre acentos corretamente
+            writer.writerow(columns)
+        writer.writerow([_cell(row.get(col)) for col in columns])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
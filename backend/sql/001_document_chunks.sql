@@ -0,0 +1,21 @@
+-- Trechos indexados dos documentos do Chat PDF (rodar no SQL Editor do Supabase)
+create extension if not exists vector;
+
+create table if not exists document_chunks (
+    id bigserial primary key,
+    document_id bigint not null references documents(id) on delete cascade, -- use uuid se documents.id for uuid
+    user_id uuid not null,
+    chunk_index integer not null,
+    content text not null,
+    embedding vector(768) not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists document_chunks_document_idx on document_chunks (document_id, chunk_index);
+create index if not exists document_chunks_user_idx on document_chunks (user_id);
+
+-- Os trechos têm o texto inteiro dos PDFs: só o backend (service_role, que ignora RLS) lê e grava.
+-- Sem isto a chave anon do frontend leria os trechos de todos os usuários pelo PostgREST.
+alter table document_chunks enable row level security;
+revoke all on table document_chunks from anon, authenticated;
+revoke all on sequence document_chunks_id_seq from anon, authenticated;
@@ -0,0 +1,31 @@
+-- Desconta 1 crédito de forma atômica (uma ida ao banco, sem corrida entre requisições simultâneas).
+-- Devolve o saldo atual, se o usuário é PRO e se o crédito foi descontado.
+-- Nenhuma linha = usuário não encontrado.
+-- Só o backend (service_role) pode chamar: a função confia no p_user_id recebido, e a chave anon
+-- do frontend permitiria gastar o crédito de outro usuário pelo PostgREST.
+create or replace function public.consume_credit(p_user_id uuid)
+returns table (credits integer, is_pro boolean, charged boolean)
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    return query
+        update profiles p
+           set credits = p.credits - 1
+         where p.id = p_user_id
+           and not coalesce(p.is_pro, false)
+           and coalesce(p.credits, 0) > 0
+     returning p.credits, false, true;
+
+    if not found then
+        return query
+            select coalesce(p.credits, 0), coalesce(p.is_pro, false), false
+              from profiles p
+             where p.id = p_user_id;
+    end if;
+end;
+$$;
+
+revoke execute on function public.consume_credit(uuid) from public, anon, authenticated;
+grant execute on function public.consume_credit(uuid) to service_role;
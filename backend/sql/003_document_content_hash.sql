@@ -0,0 +1,8 @@
+-- Deduplicação de uploads: documentos e trechos passam a ser identificados pelo SHA-256 do PDF.
+-- Uploads repetidos criam só uma linha nova em documents apontando para os trechos já existentes.
+alter table documents add column if not exists content_hash text;
+alter table documents add column if not exists chunk_count integer not null default 0;
+create index if not exists documents_content_hash_idx on documents (content_hash, created_at);
+
+alter table document_chunks add column if not exists content_hash text;
+create index if not exists document_chunks_content_hash_idx on document_chunks (content_hash, chunk_index);
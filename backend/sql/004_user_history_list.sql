@@ -0,0 +1,17 @@
+-- Listagem do histórico sem os textos completos: título, ferramenta e uma prévia curta.
+-- Os itens completos são buscados um a um pela rota /history/<id>.
+create or replace view user_history_list
+with (security_invoker = true) as
+select id,
+       user_id,
+       tool_type,
+       tool_name,
+       coalesce(nullif(metadata->>'title', ''), tool_name) as title,
+       left(input_data::text, 200) as input_preview,
+       left(output_data::text, 200) as output_preview,
+       created_at
+  from user_history;
+
+-- Paginação por cursor (created_at, id) do mais novo para o mais antigo, com e sem filtro de ferramenta
+create index if not exists user_history_user_created_idx on user_history (user_id, created_at desc, id desc);
+create index if not exists user_history_user_tool_created_idx on user_history (user_id, tool_type, created_at desc, id desc);
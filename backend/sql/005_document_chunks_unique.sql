@@ -0,0 +1,52 @@
+-- Um único conjunto de trechos por conteúdo (content_hash, chunk_index).
+-- Dois primeiros uploads simultâneos do mesmo PDF gravavam dois conjuntos; o backend agora usa upsert.
+
+-- Remove as cópias já gravadas, ficando com os trechos do documento mais antigo indexado com sucesso
+delete from document_chunks
+ where id in (select id
+                from (select c.id,
+                             row_number() over (partition by c.content_hash, c.chunk_index
+                                                order by coalesce(d.chunk_count, 0) > 0 desc, d.created_at, c.id) as rank
+                        from document_chunks c
+                        left join documents d on d.id = c.document_id
+                       where c.content_hash is not null) ranked
+               where rank > 1);
+
+-- Sobras de indexações que falharam no meio (nenhum documento com esse conteúdo terminou de indexar).
+-- Rode fora de pico: um upload em andamento também está com chunk_count = 0.
+delete from document_chunks c
+ where c.content_hash is not null
+   and not exists (select 1 from documents d where d.content_hash = c.content_hash and d.chunk_count > 0);
+
+drop index if exists document_chunks_content_hash_idx;
+create unique index if not exists document_chunks_content_hash_idx on document_chunks (content_hash, chunk_index);
+
+-- Os trechos pertencem ao primeiro upload do conteúdo (on delete cascade). Se esse documento for apagado
+-- e ainda existir outra cópia do mesmo conteúdo, os trechos passam para ela em vez de sumir.
+create or replace function public.keep_shared_chunks()
+returns trigger
+language plpgsql
+set search_path = public
+as $$
+declare
+    heir documents.id%type;
+begin
+    if old.content_hash is not null then
+        select d.id into heir
+          from documents d
+         where d.content_hash = old.content_hash
+           and d.id <> old.id
+         order by d.chunk_count > 0 desc, d.created_at
+         limit 1;
+        if heir is not null then
+            update document_chunks set document_id = heir where document_id = old.id;
+        end if;
+    end if;
+    return old;
+end;
+$$;
+
+drop trigger if exists documents_keep_shared_chunks on documents;
+create trigger documents_keep_shared_chunks
+    before delete on documents
+    for each row execute function public.keep_shared_chunks();
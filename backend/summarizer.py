@@ -0,0 +1,89 @@
+# --- RESUMO HIERÁRQUICO (MAP-REDUCE) PARA TEXTOS LONGOS ---
+# Textos que cabem numa chamada seguem com o prompt direto de sempre.
+# Os maiores são quebrados em frases, agrupados por orçamento de tokens, resumidos em paralelo
+# (map) e os resumos parciais são juntados num prompt final (reduce).
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+CHARS_PER_TOKEN = 4                       # Estimativa suficiente para português/inglês
+CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', 4000))
+MAX_PARALLEL = int(os.environ.get('SUMMARY_PARALLELISM', 4))       # Chamadas simultâneas por requisição
+MAX_INPUT_CHARS = int(os.environ.get('SUMMARY_MAX_CHARS', 2_000_000))
+MAX_REDUCE_ROUNDS = 3                     # Níveis extras de map quando os resumos parciais não cabem
+
+# Pool compartilhado pelas requisições do worker: limita o total de chamadas de map em paralelo
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SUMMARY_POOL_SIZE', 16)), thread_name_prefix='resumo')
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_sentences(text):
+    return [s for s in _SENTENCE_END.split(text) if s.strip()]
+
+def chunk_by_tokens(text, max_tokens=CHUNK_TOKENS):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks, current, size = [], [], 0
+    for sentence in split_sentences(text):
+        # Frase gigante (ex.: transcrição sem pontuação) é cortada no limite
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            if cut <= 0: cut = max_chars
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if size + len(sentence) > max_chars and current:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += len(sentence) + 1
+    if current: chunks.append(" ".join(current))
+    return chunks
+
+def _map(generate, chunks, map_prompt):
+    total = len(chunks)
+    prompts = [map_prompt.format(part=i + 1, total=total, text=chunk) for i, chunk in enumerate(chunks)]
+    results = [None] * total
+    # No máximo MAX_PARALLEL em voo para uma requisição não ocupar o pool inteiro. A janela desliza:
+    # cada parte que termina libera a próxima, sem esperar a mais lenta da leva.
+    queued = iter(range(total))
+    in_flight = {}
+    try:
+        for i in queued:
+            in_flight[_executor.submit(generate, prompts[i])] = i
+            if len(in_flight) >= MAX_PARALLEL: break
+        while in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                results[in_flight.pop(future)] = future.result().strip()
+                i = next(queued, None)
+                if i is not None: in_flight[_executor.submit(generate, prompts[i])] = i
+    finally:
+        # Uma parte falhou: as que ainda não começaram não gastam chamada ao modelo
+        for future in in_flight: future.cancel()
+    return results
+
+def build_summary_prompt(text, generate, direct_prompt, map_prompt, reduce_prompt, max_tokens=CHUNK_TOKENS):
+    # Devolve o prompt final (direto ou de reduce) para a rota enviar ao modelo, com ou sem streaming.
+    # generate(prompt) -> texto é usado nas etapas intermediárias.
+    text = text[:MAX_INPUT_CHARS]
+    if estimate_tokens(text) <= max_tokens:
+        return direct_prompt.format(text=text)
+
+    partials = _map(generate, chunk_by_tokens(text, max_tokens), map_prompt)
+    joined = "\n\n".join(partials)
+    # Resumos parciais ainda grandes demais: reduz mais um nível, até MAX_REDUCE_ROUNDS vezes
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if estimate_tokens(joined) <= max_tokens: break
+        size = len(joined)
+        partials = _map(generate, chunk_by_tokens(joined, max_tokens), map_prompt)
+        joined = "\n\n".join(partials)
+        if len(joined) >= size: break     # O modelo não está encurtando: repetir só gastaria chamadas
+    # Ainda não coube: corta no orçamento (o prompt de reduce nunca passa do limite)
+    joined = joined[:max_tokens * CHARS_PER_TOKEN]
+    return reduce_prompt.format(text=joined)
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+
+os.environ.setdefault('ADAPTA_STATE_DIR', tempfile.mkdtemp(prefix='adapta-teste-'))
+
+import gemini_client
+
+# Testes do circuit breaker do gemini_client com um modelo falso (sem rede).
+# Uso: python teste_gemini_client.py
+gemini_client.BACKOFF_BASE = 0.001
+
+
+class ErroApi(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class Resposta:
+    def __init__(self, text):
+        self.text = text
+
+
+class ModeloFalso:
+    # plano: lista de passos ('ok', '503', '400'); depois do fim do plano tudo dá certo
+    def __init__(self, plano=()):
+        self.plano = list(plano)
+        self.chamadas = 0
+
+    def generate_content(self, prompt, generation_config=None, request_options=None, stream=False):
+        self.chamadas += 1
+        passo = self.plano.pop(0) if self.plano else 'ok'
+        if passo != 'ok': raise ErroApi(int(passo))
+        if stream: return iter([Resposta('a'), Resposta('b'), Resposta('c')])
+        return Resposta('ok')
+
+
+def cliente(plano, fallback=None):
+    modelo = ModeloFalso(plano)
+    c = gemini_client.GeminiClient('principal', fallback, lambda nome: modelo)
+    breaker = c.breakers['principal']
+    breaker.failures, breaker.cooldown = 1, 0.05
+    return c, breaker
+
+
+def abrir(c, breaker):
+    # Uma falha passageira abre o breaker (failures=1); espera a janela de teste (half-open)
+    try:
+        c.generate('x')
+    except gemini_client.ModelUnavailable:
+        pass
+    assert breaker.state == 'open', breaker.state
+    time.sleep(breaker.cooldown + 0.01)
+    assert breaker.state == 'half_open'
+
+
+def teste_sonda_com_400_nao_trava_o_breaker():
+    c, breaker = cliente(['503', '400'])
+    abrir(c, breaker)
+    try:
+        c.generate('x')
+        raise AssertionError("esperava o erro 400")
+    except ErroApi as e:
+        assert e.code == 400
+    assert not breaker._probing
+    assert breaker.state == 'closed'      # O modelo respondeu: o 400 é do pedido, não do modelo
+    assert c.generate('x') == ('ok', 'principal')
+
+
+def teste_sonda_em_stream_abandonado_nao_trava_o_breaker():
+    c, breaker = cliente(['503'])
+    abrir(c, breaker)
+    # A sonda é um stream: o cliente lê um pedaço e desconecta (GeneratorExit no meio do stream)
+    stream = c.stream('x')
+    assert next(stream) == ('a', 'principal')
+    stream.close()
+    assert not breaker._probing
+    assert breaker.state == 'closed'      # Chegou texto: o modelo está respondendo
+    assert c.generate('x') == ('ok', 'principal')
+
+
+def teste_sonda_sem_desfecho_reabre_com_nova_espera():
+    # Se a sonda terminar sem success()/failure(), end_probe() devolve o breaker a aberto
+    c, breaker = cliente(['503'])
+    abrir(c, breaker)
+    assert breaker.allow() and breaker._probing
+    breaker.end_probe()
+    assert not breaker._probing and breaker.state == 'open'
+    time.sleep(breaker.cooldown + 0.01)
+    assert c.generate('x') == ('ok', 'principal')
+
+
+if __name__ == '__main__':
+    testes = [(nome, f) for nome, f in sorted(globals().items()) if nome.startswith('teste_')]
+    for nome, f in testes:
+        f()
+        print(f"ok  {nome}")
+    print(f"\n{len(testes)} testes passaram.")
@@ -0,0 +1,92 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+
+import fake_upstreams
+
+# Testes dos jobs de imagem contra o Replicate falso (fake_upstreams.py): criação, webhook e polling.
+# Uso: python teste_image_jobs.py
+servidor = fake_upstreams.FakeUpstreams(profiles=fake_upstreams.load_profiles(
+    {'replicate': 'median=0,p95=0', 'files': 'median=0,p95=0'})).start()
+os.environ.update(servidor.env())
+os.environ.setdefault('ADAPTA_STATE_DIR', tempfile.mkdtemp(prefix='adapta-teste-'))
+os.environ['IMAGE_CACHE_DIR'] = tempfile.mkdtemp(prefix='adapta-imagens-')
+
+import image_jobs
+import image_store
+
+image_jobs.POLL_INTERVAL = 0.05
+SEGREDO = 'whsec_' + base64.b64encode(b'segredo-de-teste').decode()
+
+
+def assinar(corpo, segredo=SEGREDO):
+    msg_id, timestamp = 'msg_1', str(int(time.time()))
+    chave = base64.b64decode(segredo.split('_', 1)[-1])
+    assinatura = base64.b64encode(hmac.new(chave, f"{msg_id}.{timestamp}.{corpo}".encode(), hashlib.sha256).digest()).decode()
+    return {'webhook-id': msg_id, 'webhook-timestamp': timestamp, 'webhook-signature': f"v1,{assinatura}"}
+
+
+def teste_submit_pronto_guarda_a_imagem():
+    servidor.replicate_pending = False
+    job = image_jobs.submit('u1', 'um gato')
+    assert job['status'] == 'succeeded', job
+    assert job['image_url'].startswith(servidor.url)
+    assert job['image_id'] and image_store.path_for(job['image_id'], 'thumb')
+
+
+def teste_webhook_assinado_conclui_o_job():
+    servidor.replicate_pending = True
+    image_jobs.webhook_url, image_jobs.webhook_secret = 'https://api.falsa/replicate-webhook', SEGREDO
+    try:
+        job = image_jobs.submit('u1', 'um cachorro')
+        assert job['status'] == 'starting', job
+        corpo = json.dumps({'id': job['prediction_id'], 'status': 'succeeded',
+                            'output': [f"{servidor.url}/arquivos/{job['prediction_id']}-0.webp"]})
+        assert not image_jobs.verify_webhook(assinar(corpo, 'whsec_' + base64.b64encode(b'outra').decode()), corpo)
+        assert image_jobs.verify_webhook(assinar(corpo), corpo)
+        job = image_jobs.complete_from_webhook(json.loads(corpo))
+        assert job['status'] == 'succeeded' and job['image_id'], job
+    finally:
+        image_jobs.webhook_url = image_jobs.webhook_secret = None
+
+
+def teste_sem_segredo_webhook_e_recusado():
+    corpo = json.dumps({'id': 'qualquer', 'status': 'succeeded'})
+    assert not image_jobs.verify_webhook(assinar(corpo), corpo)
+
+
+def teste_sem_webhook_o_polling_conclui_o_job():
+    servidor.replicate_pending = True
+    job = image_jobs.submit('u1', 'um pássaro')
+    assert job['status'] == 'starting', job
+    assert image_jobs.get(job['id'], 'outro-usuario') is None
+    time.sleep(image_jobs.POLL_INTERVAL + 0.01)
+    job = image_jobs.get(job['id'], 'u1')
+    assert job['status'] == 'succeeded' and job['image_id'], job
+
+
+def teste_materialize_so_baixa_do_replicate():
+    antes = servidor.counts.get('files', 0)
+    for url in ('http://169.254.169.254/latest/meta-data', 'https://exemplo.com/a.webp', 'file:///etc/passwd',
+                'https://replicate.delivery.exemplo.com/a.webp'):
+        assert not image_store.allowed_url(url), url
+        assert image_store.materialize_safe(url) is None
+    assert servidor.counts.get('files', 0) == antes
+    padrao, image_store.ALLOWED_HOSTS = image_store.ALLOWED_HOSTS, ['replicate.delivery', '*.replicate.delivery']
+    try:
+        assert image_store.allowed_url('https://pbxt.replicate.delivery/x/out-0.webp')
+        assert not image_store.allowed_url(f"{servidor.url}/arquivos/a.webp")
+    finally:
+        image_store.ALLOWED_HOSTS = padrao
+
+
+if __name__ == '__main__':
+    testes = [(nome, f) for nome, f in sorted(globals().items()) if nome.startswith('teste_')]
+    for nome, f in testes:
+        f()
+        print(f"ok  {nome}")
+    print(f"\n{len(testes)} testes passaram.")
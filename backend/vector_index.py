@@ -0,0 +1,143 @@
+# --- ÍNDICE VETORIAL EM MEMÓRIA (CHAT PDF) ---
+# Mantém os embeddings dos trechos de cada usuário numa matriz float32 contígua.
+# A busca é um único produto matriz-vetor + argpartition, sem ir ao banco a cada pergunta.
+# Um upload invalida o índice do usuário em todos os workers do gunicorn por um log SQLite local próprio
+# (store 'vetores', no mesmo formato do log do cache de perfis, lido no máximo a cada SYNC_INTERVAL
+# segundos); o TTL cobre outras máquinas.
+import threading
+import time
+from collections import OrderedDict
+
+import lazy_tools
+import local_store
+
+np = lazy_tools.module('vectors', 'numpy')
+
+
+class _UserVectors:
+    __slots__ = ('matrix', 'source_ids', 'chunk_indexes', 'contents', 'nbytes', 'expires_at')
+
+    def __init__(self, rows):
+        n = len(rows)
+        dim = len(rows[0]['embedding']) if n else 0
+        matrix = np.empty((n, dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            matrix[i] = row['embedding']
+        # Normaliza uma vez no carregamento: o produto escalar vira similaridade de cosseno
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+
+        self.matrix = np.ascontiguousarray(matrix)
+        self.source_ids = np.array([str(row['source_id']) for row in rows], dtype=object)
+        self.chunk_indexes = np.array([row['chunk_index'] for row in rows], dtype=np.int32)
+        self.contents = [row['content'] for row in rows]
+        self.nbytes = (self.matrix.nbytes + self.chunk_indexes.nbytes
+                       + sum(len(c) for c in self.contents) + 64 * n)
+        self.expires_at = 0.0
+
+
+class VectorIndex:
+    SYNC_INTERVAL = 1.0
+    LOG_RETENTION = 3600
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, loader, max_bytes=256 * 1024 * 1024, ttl=600, store_name='vetores'):
+        # loader(user_id) -> lista de dicts com source_id, chunk_index, content, embedding
+        # source_id identifica o conteúdo do documento (hash do PDF ou id de documentos antigos)
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store_name = store_name
+        self.total_bytes = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sync = 0.0
+        self._next_prune = 0.0
+
+        conn = local_store.connect(store_name)
+        conn.execute("CREATE TABLE IF NOT EXISTS invalidations (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "user_id TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+
+    def _get(self, user_id):
+        self._sync()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry.expires_at >= time.time():
+                self._users.move_to_end(user_id)
+                return entry
+
+        # Carrega fora do lock para não travar buscas de outros usuários
+        entry = _UserVectors(self.loader(user_id))
+        entry.expires_at = time.time() + self.ttl
+
+        with self._lock:
+            old = self._users.pop(user_id, None)
+            if old is not None: self.total_bytes -= old.nbytes
+            self._users[user_id] = entry
+            self.total_bytes += entry.nbytes
+            # Despeja os usuários menos usados até caber no orçamento de memória
+            while self.total_bytes > self.max_bytes and len(self._users) > 1:
+                _, evicted = self._users.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+        return entry
+
+    def forget(self, user_id):
+        # Só neste worker (ex.: o índice em memória está atrás do banco)
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is not None: self.total_bytes -= entry.nbytes
+
+    def invalidate(self, user_id):
+        # Neste worker e, pelo log, em todos os outros
+        self.forget(user_id)
+        try:
+            local_store.connect(self.store_name).execute(
+                "INSERT INTO invalidations (user_id, created_at) VALUES (?, ?)", (str(user_id), time.time()))
+        except Exception as e:
+            print(f"Aviso: falha ao propagar invalidação do índice vetorial: {e}")
+
+    def _sync(self):
+        now = time.time()
+        if now < self._next_sync: return
+        self._next_sync = now + self.SYNC_INTERVAL
+        try:
+            conn = local_store.connect(self.store_name)
+            rows = conn.execute("SELECT seq, user_id FROM invalidations WHERE seq > ? ORDER BY seq",
+                                (self._last_seq,)).fetchall()
+            for _, user_id in rows:
+                self.forget(user_id)
+            if rows: self._last_seq = rows[-1][0]
+            if now >= self._next_prune:
+                self._next_prune = now + self.PRUNE_INTERVAL
+                conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - self.LOG_RETENTION,))
+        except Exception as e:
+            print(f"Aviso: falha ao ler invalidações do índice vetorial: {e}")
+
+    def search(self, user_id, query_vector, k=6, source_id=None):
+        entry = self._get(user_id)
+        if not len(entry.contents): return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm: query = query / norm
+
+        scores = entry.matrix @ query
+        if source_id is not None:
+            scores = np.where(entry.source_ids == str(source_id), scores, -np.inf)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.isfinite(scores[top])]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(entry.chunk_indexes[i]), entry.contents[i]) for i in top]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'chunks': sum(len(e.contents) for e in self._users.values()),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
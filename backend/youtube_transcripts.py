@@ -0,0 +1,62 @@
+# --- TRANSCRIÇÕES DO YOUTUBE COM CACHE ---
+# A legenda de um vídeo não muda: guardamos o texto por vídeo + idiomas (memória + SQLite local)
+# e só chamamos o YouTube na primeira vez.
+import io
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import lazy_tools
+from response_cache import ResponseCache
+
+pytube = lazy_tools.module('youtube', 'pytube')
+
+CAPTION_LANGS = ('pt', 'en', 'a.pt')   # Ordem de preferência das legendas
+NO_CAPTION_TTL = 3600                  # "Sem legenda" é lembrado por menos tempo
+
+transcript_store = ResponseCache(
+    'transcricoes',
+    memory_bytes=int(os.environ.get('TRANSCRIPT_CACHE_MEMORY_MB', 64)) * 1024 * 1024,
+    disk_bytes=int(os.environ.get('TRANSCRIPT_CACHE_DISK_MB', 1024)) * 1024 * 1024,
+    ttl=int(os.environ.get('TRANSCRIPT_CACHE_TTL', 7 * 24 * 3600))
+)
+
+
+def video_id_from_url(url):
+    return pytube.extract.video_id(url)
+
+def parse_caption_xml(xml):
+    # iterparse libera cada <text> depois de lido, sem montar a árvore inteira na memória
+    parts = []
+    for _, elem in ET.iterparse(io.BytesIO(xml.encode('utf-8')), events=('end',)):
+        if elem.tag in ('text', 'p') and elem.text: parts.append(elem.text)
+        elem.clear()
+    return " ".join(parts)
+
+def transcript_key(video_id, langs=CAPTION_LANGS):
+    return f"{video_id}:{','.join(langs)}"
+
+def get_transcript(url, langs=CAPTION_LANGS):
+    # Devolve (video_id, idioma, texto); idioma None quando o vídeo não tem legenda
+    video_id = video_id_from_url(url)
+    key = transcript_key(video_id, langs)
+    cached = transcript_store.get(key)
+    if cached is not None:
+        data = json.loads(cached)
+        return video_id, data['lang'], data['text']
+
+    yt = pytube.YouTube(f"https://www.youtube.com/watch?v={video_id}")
+    caption, lang = None, None
+    for code in langs:
+        caption = yt.captions.get_by_language_code(code)
+        if caption:
+            lang = code
+            break
+
+    if not caption:
+        transcript_store.set(key, json.dumps({'lang': None, 'text': ''}), ttl=NO_CAPTION_TTL)
+        return video_id, None, ''
+
+    text = parse_caption_xml(caption.xml_captions)
+    transcript_store.set(key, json.dumps({'lang': lang, 'text': text}, ensure_ascii=False))
+    return video_id, lang, text